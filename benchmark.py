@@ -0,0 +1,236 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import openpyxl
+import pandas as pd
+from config import CONFIG
+from ingest_cache import read_excel_cached
+from instrumentation import StageMetrics
+from log_utils import MessageLog
+from parallel_utils import available_cpus
+from pivot_processor import PivotProcessor
+from run_config import RunConfig
+from synthetic_data import MAIN_FILES, generate_inputs
+
+# 结果格式版本：阶段划分或字段变化时递增，与不同版本的基线比较时给出提示
+BENCHMARK_VERSION = 2
+
+ADDITIONAL_FILES = ["forecast.xlsx", "safety.xlsx", "mapping.xlsx"]
+
+
+@contextmanager
+def ingest_cache_disabled():
+    """
+    计时期间关闭上传文件解析缓存（否则第二次起读取只是加载缓存）。
+    """
+    settings = CONFIG.setdefault("ingest_cache", {})
+    enabled = settings.get("enabled", True)
+    settings["enabled"] = False
+    try:
+        yield
+    finally:
+        settings["enabled"] = enabled
+
+
+def run_pipeline(data_dir, run_config):
+    """
+    对 data_dir 中的输入跑一遍完整流程：先读取、清洗辅助文件，再完整执行 PivotProcessor.process
+    （各源文件的读取 / 清洗 / 新旧料号替换 / 透视、各项汇总合并、标色、写出，见 instrumentation.StageMetrics）。
+    run_config.profile_memory 时记录峰值内存，run_config.profile_run 时对 process 做性能分析。
+
+    返回:
+    - records: 各阶段记录（StageMetrics.records）
+    - total_seconds: 整体耗时
+    - profile: 性能分析结果（RunProfile），未开启时为 None
+    """
+    files = {}
+    for name in MAIN_FILES + ADDITIONAL_FILES:
+        with open(os.path.join(data_dir, name), "rb") as f:
+            files[name] = f.read()
+
+    metrics = StageMetrics(run_config.profile_memory)
+    processor = PivotProcessor(run_config)
+    with metrics.tracing(top=0):
+        additional_sheets = {
+            name.replace(".xlsx", ""): read_excel_cached(io.BytesIO(files[name]), metrics=metrics, source=name.replace(".xlsx", ""))
+            for name in ADDITIONAL_FILES
+        }
+        log = MessageLog()
+        uploaded_files = {name: io.BytesIO(files[name]) for name in MAIN_FILES}
+        processor.process(uploaded_files, io.BytesIO(), additional_sheets, log)
+
+    errors = [message for level, message in log.messages if level == "error"]
+    if errors:
+        raise RuntimeError(f"流程报错：{errors[0]}")
+    return metrics.records + processor.metrics.records, metrics.total_seconds, processor.profile
+
+
+def stage_table(records):
+    """
+    各阶段记录按“阶段/来源”命名：名称 → {"seconds", "cpu_seconds", "rows_in", "rows_out", "peak_mb"}。
+    """
+    return {
+        f"{record['stage']}/{record['source']}" if record["source"] else record["stage"]: {
+            name: value for name, value in record.items() if name not in ("stage", "source")
+        }
+        for record in records
+    }
+
+
+def run_benchmark(data_dir, run_config, repeat=3, trace_memory=True):
+    """
+    重复 repeat 次计时（各阶段取最小值，减少干扰），trace_memory 时再单独跑一次记录峰值内存
+    （tracemalloc 会拖慢执行，不与计时同时进行）。
+
+    返回:
+    - stages: dict，阶段名 → {"seconds", "cpu_seconds", "rows_in", "rows_out", "peak_mb"}
+    - total_seconds: 整体耗时（最小值）
+    """
+    run_config = run_config.replace(ingest_workers=1, profile_memory=False, profile_run=False)
+    stages, totals = {}, []
+    with ingest_cache_disabled():
+        for _ in range(repeat):
+            records, total, _ = run_pipeline(data_dir, run_config)
+            totals.append(total)
+            for name, stage in stage_table(records).items():
+                best = stages.setdefault(name, dict(stage))
+                best["seconds"] = min(best["seconds"], stage["seconds"])
+                best["cpu_seconds"] = min(best["cpu_seconds"], stage["cpu_seconds"])
+
+        if trace_memory:
+            records, _, _ = run_pipeline(data_dir, run_config.replace(profile_memory=True))
+            for name, stage in stage_table(records).items():
+                stages.setdefault(name, dict(stage))["peak_mb"] = stage["peak_mb"]
+
+    return stages, min(totals)
+
+
+def compare_results(baseline, current, threshold=1.25, min_seconds=0.05):
+    """
+    与基线逐阶段比较耗时。耗时超过基线 threshold 倍且多出 min_seconds 以上的阶段记为退化。
+
+    返回:
+    - DataFrame：阶段、基线耗时、本次耗时、倍数、是否退化（只含两边都有的阶段）
+    """
+    rows = []
+    for name, stage in current["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            continue
+        ratio = stage["seconds"] / base["seconds"] if base["seconds"] else np.inf
+        regressed = ratio > threshold and stage["seconds"] - base["seconds"] > min_seconds
+        rows.append((name, base["seconds"], stage["seconds"], ratio, regressed))
+    return pd.DataFrame(rows, columns=["阶段", "基线(秒)", "本次(秒)", "倍数", "退化"])
+
+
+def _test_params(result):
+    # 重复次数不影响各阶段耗时的可比性
+    return {name: value for name, value in result.get("params", {}).items() if name != "repeat"}
+
+
+def default_data_dir(rows, keys, duplicate_rate, seed):
+    return os.path.join(tempfile.gettempdir(), f"pivot_benchmark_{rows}_{keys}_{duplicate_rate}_{seed}")
+
+
+def prepare_inputs(data_dir, rows, keys, duplicate_rate, seed):
+    """
+    生成（或复用已生成的）合成输入，返回各文件行数。参数相同的目录只生成一次。
+    """
+    params = {"rows": rows, "keys": keys, "duplicate_rate": duplicate_rate, "seed": seed}
+    marker = os.path.join(data_dir, "inputs.json")
+    if os.path.exists(marker):
+        with open(marker, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved["params"] == params:
+            return saved["counts"]
+
+    counts = generate_inputs(data_dir, rows, keys, duplicate_rate, seed=seed)
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "counts": counts}, f, ensure_ascii=False)
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="用合成数据按阶段测试整个流程的耗时和内存，输出可与基线比较的 JSON。")
+    parser.add_argument("--data-dir", help="输入目录（不存在或参数不同时按下列参数生成，默认在系统临时目录）")
+    parser.add_argument("--rows", type=int, default=10000, help="五个主表的总行数（默认 10000）")
+    parser.add_argument("--keys", type=int, help="主键基数（默认 rows / 20）")
+    parser.add_argument("--dup-rate", type=float, default=0.05, help="新旧料号表中旧料号重复的比例（默认 0.05）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--month", default="2025-06", help="历史数据截止月份（默认 2025-06）")
+    parser.add_argument("--low-memory", action="store_true", help="低内存模式")
+    parser.add_argument("--repeat", type=int, default=3, help="计时重复次数，各阶段取最小值（默认 3）")
+    parser.add_argument("--no-memory", action="store_true", help="不记录峰值内存")
+    parser.add_argument("--profile", help="另跑一次 cProfile 性能分析，结果保存到此 .prof 文件")
+    parser.add_argument("-o", "--output", help="结果 JSON 的保存路径（可作为之后的基线）")
+    parser.add_argument("--baseline", help="基线 JSON，逐阶段比较并在有退化时返回 1")
+    parser.add_argument("--threshold", type=float, default=1.25, help="退化判定倍数（默认 1.25）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    keys = args.keys or max(args.rows // 20, 10)
+    data_dir = args.data_dir or default_data_dir(args.rows, keys, args.dup_rate, args.seed)
+    counts = prepare_inputs(data_dir, args.rows, keys, args.dup_rate, args.seed)
+
+    run_config = RunConfig.from_config(selected_month=args.month, low_memory=args.low_memory)
+    stages, total = run_benchmark(data_dir, run_config, args.repeat, not args.no_memory)
+    result = {
+        "version": BENCHMARK_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+            "openpyxl": openpyxl.__version__, "platform": platform.platform(), "cpus": available_cpus()
+        },
+        "params": {
+            "rows": args.rows, "keys": keys, "duplicate_rate": args.dup_rate, "seed": args.seed,
+            "selected_month": args.month, "low_memory": args.low_memory, "repeat": args.repeat
+        },
+        "inputs": counts,
+        "stages": stages,
+        "total_seconds": total
+    }
+
+    table = pd.DataFrame.from_dict(stages, orient="index")
+    table = table.astype({"rows_in": "Int64", "rows_out": "Int64"})
+    print(table.to_string(float_format=lambda value: f"{value:.3f}"))
+    print(f"合计 {total:.3f} 秒")
+
+    if args.profile:
+        with ingest_cache_disabled():
+            _, _, profile = run_pipeline(data_dir, run_config.replace(ingest_workers=1, profile_run=True))
+        with open(args.profile, "wb") as f:
+            f.write(profile.dump())
+        print(f"✅ 性能分析已保存：{args.profile}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已保存：{args.output}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("version") != BENCHMARK_VERSION or _test_params(baseline) != _test_params(result):
+        print("⚠️ 基线的格式版本或测试参数与本次不同，比较结果仅供参考", file=sys.stderr)
+    comparison = compare_results(baseline, result, args.threshold)
+    print(comparison.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    regressed = comparison[comparison["退化"]]
+    if regressed.empty:
+        print("✅ 未发现退化")
+        return 0
+    print(f"❌ {len(regressed)} 个阶段退化：{'、'.join(regressed['阶段'])}", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import argparse
+import io
+import os
+import sys
+from config import CONFIG, FILE_RENAME_MAPPING
+from date_utils import parse_month, parse_months
+from ingest_cache import read_excel_many
+from instrumentation import TOP_FUNCTIONS
+from log_utils import ConsoleLog
+from parallel_utils import map_in_pool
+from pivot_processor import PivotProcessor
+from run_config import RunConfig
+
+# 报告文件名前缀（快照批量生成时后接快照目录名）
+REPORT_NAME = "运营数据订单-在制-库存汇总报告"
+
+# 辅助文件（预测、安全库存、新旧料号），缺少时跳过
+ADDITIONAL_FILES = ["forecast.xlsx", "safety.xlsx", "mapping.xlsx"]
+
+
+def find_input_files(input_dir, run_config):
+    """
+    在输入目录中查找源文件，中文文件名按 FILE_RENAME_MAPPING 换成内部文件名。
+
+    返回:
+    - main_files: 内部文件名 → 路径（按 pivot_config 的顺序，即写出 sheet 的顺序）
+    - additional_files: 辅助文件名 → 路径
+    """
+    found = {}
+    for name in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, name)
+        if os.path.isfile(path):
+            found.setdefault(FILE_RENAME_MAPPING.get(name, name), path)
+
+    main_files = {name: found[name] for name in run_config.pivot_config if name in found}
+    additional_files = {name: found[name] for name in ADDITIONAL_FILES if name in found}
+    return main_files, additional_files
+
+
+def run_report(input_dir, output_file, run_config, log, save_metrics=False):
+    """
+    对一个输入目录生成汇总报告（流程与页面上“生成汇总 Excel”相同），写出到 output_file。
+    save_metrics 时各阶段记录另存为 metrics_path(output_file)；
+    run_config.profile_run 时性能分析结果另存为 profile_path(output_file)，并输出耗时最多的函数。
+
+    异常:
+    - FileNotFoundError: 缺少源文件
+    """
+    main_files, additional_files = find_input_files(input_dir, run_config)
+    missing = [name for name in run_config.pivot_config if name not in main_files]
+    if missing:
+        raise FileNotFoundError(f"`{input_dir}` 中缺少源文件：{'、'.join(missing)}")
+    for name in ADDITIONAL_FILES:
+        if name not in additional_files:
+            log.warning(f"⚠️ 未提供辅助文件：{name}")
+
+    uploaded_files = {}
+    for name, path in main_files.items():
+        with open(path, "rb") as f:
+            uploaded_files[name] = io.BytesIO(f.read())
+    additional_bytes = {}
+    for name, path in additional_files.items():
+        with open(path, "rb") as f:
+            additional_bytes[name] = f.read()
+    additional_sheets = {
+        name.replace(".xlsx", ""): df
+        for name, df in read_excel_many(additional_bytes, run_config.ingest_workers).items()
+    }
+
+    buffer = io.BytesIO()
+    processor = PivotProcessor(run_config)
+    processor.process(uploaded_files, buffer, additional_sheets, log)
+    data = buffer.getvalue()
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    if save_metrics:
+        with open(metrics_path(output_file), "w", encoding="utf-8") as f:
+            f.write(processor.metrics.to_json())
+    if processor.profile is not None:
+        with open(profile_path(output_file), "wb") as f:
+            f.write(processor.profile.dump())
+        log.info(f"🔬 性能分析已保存：{profile_path(output_file)}（累计耗时前 {TOP_FUNCTIONS} 个函数如下）")
+        log.write(format_top_functions(processor.profile.top_functions(TOP_FUNCTIONS)))
+    if not data:
+        raise RuntimeError("未生成汇总文件")
+
+    with open(output_file, "wb") as f:
+        f.write(data)
+    return output_file
+
+
+def metrics_path(output_file):
+    """
+    报告对应的各阶段记录文件：报告名.metrics.json。
+    """
+    return f"{os.path.splitext(output_file)[0]}.metrics.json"
+
+
+def profile_path(output_file):
+    """
+    报告对应的性能分析文件：报告名.prof（可用 python -m pstats / snakeviz 查看）。
+    """
+    return f"{os.path.splitext(output_file)[0]}.prof"
+
+
+def format_top_functions(rows):
+    # 表头为中文（每字占两列宽），按显示宽度与数据列对齐
+    lines = ["  累计(秒)   自身(秒)   调用次数  函数"]
+    for row in rows:
+        lines.append(f"{row['cumtime']:>10.3f} {row['tottime']:>10.3f} {row['calls']:>10}  {row['function']}")
+    return "\n".join(lines)
+
+
+def run_snapshot(input_dir, output_file, run_config, label=None, quiet=False, save_metrics=False):
+    """
+    在进程池中生成一个快照的报告，提示按快照名加前缀输出。返回 (输出文件, 错误信息)。
+    """
+    log = ConsoleLog(label, quiet)
+    try:
+        run_report(input_dir, output_file, run_config, log, save_metrics)
+    except Exception as e:
+        log.error(f"❌ 生成失败：{e}")
+        return output_file, str(e)
+    if log.error_count:
+        log.warning(f"⚠️ 报告已生成，但处理过程中有 {log.error_count} 条错误提示")
+    return output_file, None
+
+
+def snapshot_dirs(root):
+    """
+    快照根目录下的各快照目录（如按日期命名的 2025-06-01/），按名称排序。
+    """
+    return [
+        os.path.join(root, name) for name in sorted(os.listdir(root))
+        if os.path.isdir(os.path.join(root, name)) and not name.startswith(".")
+    ]
+
+
+def _month_arg(parse):
+    # 月份格式不对时由 argparse 报错退出（错误信息中列出格式不对的月份）
+    def convert(text):
+        try:
+            return parse(text)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    return convert
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="不经过页面，直接对输入目录（或多个快照目录并行）生成汇总报告。"
+    )
+    parser.add_argument("input_dirs", nargs="*", help="输入目录，默认为 CONFIG['input_dir']；给出多个时并行处理")
+    parser.add_argument("--snapshots", help="快照根目录：其下每个子目录（如按日期命名）各生成一份报告，并行处理")
+    parser.add_argument("-o", "--output", help="输出文件（单个目录时，默认为 CONFIG['output_file']）或输出目录（多个目录 / 快照时，默认为各输入目录的上级目录）")
+    parser.add_argument("--month", type=_month_arg(parse_month), help="历史数据截止月份（YYYY-MM）")
+    parser.add_argument("--sweep", type=_month_arg(parse_months), help="多截止月份对比（YYYY-MM，用逗号分隔）")
+    parser.add_argument("--sweep-layout", choices=["sheets", "long"], help="多截止月份对比的写出方式")
+    parser.add_argument("--reconciliation", action="store_true", default=None, help="输出“对账” sheet")
+    parser.add_argument("--drop-zero-rows", action="store_true", default=None, help="透视前删除数值列全为 0 的行")
+    parser.add_argument("--low-memory", action="store_true", default=None, help="低内存模式")
+    parser.add_argument("--highlight-style", choices=["conditional", "cell"], help="标色写出方式")
+    parser.add_argument("--profile-memory", action="store_true", default=None, help="各阶段记录中另记峰值内存（处理明显变慢）")
+    parser.add_argument("--profile", action="store_true", default=None, help="用 cProfile 分析生成过程，另存为 报告名.prof 并输出耗时最多的函数")
+    parser.add_argument("--metrics", action="store_true", help="各报告旁另存各阶段耗时记录（报告名.metrics.json）")
+    parser.add_argument("--workers", type=int, help="并行处理的进程数：多个目录 / 快照时为同时处理的目录数，单个目录时为解析源文件的进程数（默认按 CPU 核数）")
+    parser.add_argument("-q", "--quiet", action="store_true", help="只输出警告和错误")
+    return parser.parse_args(argv)
+
+
+def build_run_config(args):
+    options = {
+        "selected_month": args.month,
+        "sweep_months": args.sweep or None,
+        "sweep_layout": args.sweep_layout,
+        "reconciliation_sheet": args.reconciliation,
+        "drop_zero_rows": args.drop_zero_rows,
+        "low_memory": args.low_memory,
+        "highlight_style": args.highlight_style,
+        "profile_memory": args.profile_memory,
+        "profile_run": args.profile
+    }
+    return RunConfig.from_config(**{name: value for name, value in options.items() if value is not None})
+
+
+def main(argv=None):
+    """
+    命令行入口，返回退出码（有报告生成失败时为 1）。
+
+    用法:
+        python cli.py                                    # CONFIG["input_dir"] → CONFIG["output_file"]
+        python cli.py 输入目录 -o 报告.xlsx --month 2025-03
+        python cli.py --snapshots 快照根目录 -o 输出目录 --workers 4
+        python cli.py 输入目录 --metrics --profile-memory    # 另存各阶段耗时和峰值内存
+        python cli.py 输入目录 --profile                     # 另存性能分析结果（报告名.prof）
+    """
+    args = parse_args(argv)
+    run_config = build_run_config(args)
+
+    input_dirs = snapshot_dirs(args.snapshots) if args.snapshots else (args.input_dirs or [CONFIG["input_dir"]])
+    if not input_dirs:
+        print(f"❌ `{args.snapshots}` 中没有快照目录", file=sys.stderr)
+        return 1
+
+    if len(input_dirs) == 1 and not args.snapshots:
+        # 单个目录：--workers 用于目录内并行解析源文件
+        if args.workers is not None:
+            run_config = run_config.replace(ingest_workers=args.workers)
+        output_file = args.output or CONFIG["output_file"]
+        output_file, error = run_snapshot(input_dirs[0], output_file, run_config, quiet=args.quiet, save_metrics=args.metrics)
+        if error is None:
+            print(f"✅ 已生成：{output_file}")
+        return 0 if error is None else 1
+
+    # 多个目录：目录之间按进程并行，未指定时单个目录内顺序解析源文件，避免进程数成倍增加
+    if run_config.ingest_workers is None:
+        run_config = run_config.replace(ingest_workers=1)
+    tasks = []
+    for input_dir in input_dirs:
+        label = os.path.basename(os.path.normpath(input_dir))
+        output_dir = args.output or os.path.dirname(os.path.abspath(input_dir))
+        output_file = os.path.join(output_dir, f"{REPORT_NAME}_{label}.xlsx")
+        tasks.append((input_dir, output_file, run_config, label, args.quiet, args.metrics))
+
+    results = map_in_pool(run_snapshot, tasks, args.workers)
+    failed = [(task[3], error) for task, (_, error) in zip(tasks, results) if error is not None]
+    for task, (output_file, error) in zip(tasks, results):
+        if error is None:
+            print(f"✅ [{task[3]}] 已生成：{output_file}")
+    for label, error in failed:
+        print(f"❌ [{label}] {error}", file=sys.stderr)
+    print(f"共 {len(tasks)} 个目录，成功 {len(tasks) - len(failed)} 个，失败 {len(failed)} 个")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,46 @@
 from datetime import datetime
 
 CONFIG = {
+    # 命令行（cli.py）未指定时的输入目录和输出文件
     "input_dir": r"/Users/tttriste.kkkkkk/Desktop/semi",
     "output_file": f"/Users/tttriste.kkkkkk/Desktop/semi/运营数据订单-在制-库存汇总报告_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+    # 以下选项及 pivot_config 为默认值，每次运行的实际取值在 run_config.RunConfig 中（运行时不修改 CONFIG）
+    # 是否输出各来源主键匹配统计的“对账” sheet
+    "reconciliation_sheet": False,
+    # 透视前删除数值列全为 0 的行
+    "drop_zero_rows": False,
+    # 新旧料号表中旧料号重复时的处理：first（保留第一条）/ last（保留最后一条）/ error（对应不同新料号时报错）
+    "mapping_duplicate_policy": "first",
+    # 是否把多级新旧料号替换（A→B、B→C）直接解析为最终料号（A→C）
+    "resolve_mapping_chains": True,
+    # 标色写出方式：conditional（条件格式区间，文件小）/ cell（逐格样式，排序后颜色随行移动）
+    "highlight_style": "conditional",
+    # 多截止月份对比：截止月份列表（为空表示不对比），一次透视后按各截止月份切分历史/未来月份
+    "sweep_months": [],
+    # 对比结果的写出方式：sheets（每个截止月份一个“汇总_YYYY-MM” sheet）/ long（一个“截止月份对比”长表）
+    "sweep_layout": "sheets",
+    # 低内存模式：主键等文本维度按共享字典编码为分类列，分组、透视、连接都在编码上进行，写出时才还原
+    "low_memory": False,
+    # 源文件并行处理的进程数：None 表示按 CPU 核数，1 表示在当前进程顺序处理
+    "ingest_workers": None,
+    # 各阶段耗时记录中另记峰值内存（开启 tracemalloc，处理明显变慢，仅用于排查内存问题）
+    "profile_memory": False,
+    # 用 cProfile 分析整个生成过程（各函数耗时，处理变慢；开启时源文件在当前进程顺序解析）
+    "profile_run": False,
+    # 后台生成任务：workers 为任务进程数（None 表示按 CPU 核数），dir 为任务状态和结果目录（为空时使用系统临时目录下当前用户专用的目录，权限 0o700），
+    # 超过 max_age_hours 的任务在提交新任务时清理；ingest_workers 为单个任务内解析源文件的进程数（None 表示按同时运行的任务数平分 CPU 核数）
+    "job_queue": {
+        "workers": None,
+        "dir": None,
+        "max_age_hours": 24,
+        "ingest_workers": None
+    },
+    # 上传文件解析结果缓存（按文件内容哈希），dir 为空时使用系统临时目录下当前用户专用的目录（权限 0o700）
+    "ingest_cache": {
+        "enabled": True,
+        "dir": None,
+        "max_bytes": 512 * 1024 * 1024
+    },
     "pivot_config": {
         "unfulfilled_orders.xlsx": {
             "index": ["晶圆品名", "规格", "品名"],
@@ -55,3 +93,12 @@ FILE_RENAME_MAPPING = {
 # 用于生成 sheet 名时还原中文
 REVERSE_MAPPING = {v.replace(".xlsx", ""): k.replace(".xlsx", "") for k, v in FILE_RENAME_MAPPING.items()}
 
+
+# 各来源表中 (晶圆品名, 规格, 品名) 主键对应的列名
+FIELD_MAPPINGS = {
+    "unfulfilled_orders": {"规格": "规格", "品名": "品名", "晶圆品名": "晶圆品名"},
+    "finished_products": {"规格": "产品规格", "品名": "产品品名", "晶圆品名": "晶圆型号"},
+    "finished_inventory": {"规格": "规格", "品名": "品名", "晶圆品名": "WAFER品名"},
+    "safety": {"规格": "OrderInformation", "品名": "ProductionNO.", "晶圆品名": "WaferID"},
+    "forecast": {"规格": "产品型号", "品名": "ProductionNO.", "晶圆品名": "晶圆品名"}
+}
@@ -1,49 +1,30 @@
 
-def create_pivot(df, config):
-    from datetime import datetime, timedelta
-    import pandas as pd
+def create_pivot(df, config, selected_month=None):
+    from date_utils import month_bucket, to_datetime_column
     from month_selector import process_history_columns
-
-    def _excel_serial_to_date(serial):
-        try:
-            return datetime(1899, 12, 30) + timedelta(days=float(serial))
-        except:
-            return pd.NaT
+    from month_blocks import MonthBlocks
+    from pivot_engine import is_summable, pivot_from_config
 
     if "date_format" in config:
         date_col = config["columns"]
-        if pd.api.types.is_numeric_dtype(df[date_col]):
-            df[date_col] = df[date_col].apply(_excel_serial_to_date)
-        else:
-            df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
+        df[date_col] = to_datetime_column(df[date_col])
         new_col = f"{date_col}_年月"
-        df[new_col] = df[date_col].dt.strftime(config["date_format"])
-        df[new_col] = df[new_col].fillna("未知日期")
+        df[new_col] = month_bucket(df[date_col], config["date_format"])
         config = config.copy()
         config["columns"] = new_col
 
-    pivoted = pd.pivot_table(
-        df,
-        index=config["index"],
-        columns=config["columns"],
-        values=config["values"],
-        aggfunc=config["aggfunc"],
-        fill_value=0
-    )
-
-    pivoted.columns = [f"{col[0]}_{col[1]}" if isinstance(col, tuple) else str(col) for col in pivoted.columns]
-
-    if pd.Series(pivoted.columns).duplicated().any():
-        from pandas.io.parsers import ParserBase
-        original_cols = pivoted.columns
-        deduped_cols = ParserBase({'names': original_cols})._maybe_dedup_names(original_cols)
-        pivoted.columns = deduped_cols
-
-    pivoted = pivoted.reset_index()
-
     # 历史数据合并
-    from config import CONFIG
-    if CONFIG.get("selected_month") and config.get("values") and "未交订单数量" in config.get("values"):
-        pivoted = process_history_columns(pivoted, config, CONFIG["selected_month"])
+    history = selected_month and config.get("values") and "未交订单数量" in config.get("values")
+
+    # 按月份分桶时在月份数组上合并历史，再展开为列
+    if "date_format" in config and config.get("aggfunc", "sum") == "sum" and all(is_summable(df[col]) for col in config["values"]):
+        blocks = MonthBlocks.pivot(df, config["index"], config["columns"], config["values"])
+        if history:
+            blocks = blocks.fold_history(selected_month)
+        return blocks.to_frame()
+
+    pivoted = pivot_from_config(df, config)
+    if history:
+        pivoted = process_history_columns(pivoted, config, selected_month)
 
     return pivoted
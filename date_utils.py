@@ -0,0 +1,111 @@
+import re
+import numpy as np
+import pandas as pd
+
+# Excel 序列日期的起点（兼容 1900 年闰年错误）
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+# 能换算为 Timedelta（进而落在 datetime64 范围内）的最大序列值
+MAX_EXCEL_SERIAL = pd.Timedelta.max.days
+
+UNKNOWN_DATE_LABEL = "未知日期"
+
+# 截止月份的格式：YYYY-MM（月份为 01-12）
+MONTH_PATTERN = re.compile(r"\d{4}-(0[1-9]|1[0-2])")
+
+
+def to_datetime_column(values):
+    """
+    一次性将日期列转换为 datetime64，兼容以下混合情况：
+    - Excel 序列日期（数值或数字字符串）
+    - 日期字符串 / datetime 对象（"20250115"、"2025.01" 这类像数字的字符串优先按日期文本解析）
+    - 无法识别的值转为 NaT
+
+    参数:
+    - values: Series 或类数组
+
+    返回:
+    - datetime64 Series（索引与输入一致）
+    """
+    series = pd.Series(values, copy=False)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if pd.api.types.is_numeric_dtype(series):
+        return _serial_to_datetime(series)
+
+    # 混合列：只转换去重后的取值，再按编码映射回每一行
+    codes, uniques = pd.factorize(series)
+    uniques = pd.Series(uniques, dtype=object)
+    numeric = pd.to_numeric(uniques, errors="coerce")
+    serial = uniques.map(type).ne(str) & numeric.notna()
+    converted = _serial_to_datetime(numeric.where(serial))
+    text = ~serial
+
+    # 字符串和 datetime 对象先按日期文本解析，解析不了的数字字符串（如 "45658"）再按序列日期换算
+    if text.any():
+        converted[text] = _parse_date_values(uniques[text])
+        serial_text = text & converted.isna() & numeric.notna()
+        converted[serial_text] = _serial_to_datetime(numeric[serial_text])
+
+    converted = pd.concat([converted, pd.Series([pd.NaT], dtype=converted.dtype)], ignore_index=True)
+    return pd.Series(converted.to_numpy()[codes], index=series.index)
+
+
+def _serial_to_datetime(serials):
+    """
+    Excel 序列日期 → datetime64，超出范围或非数值的序列值为 NaT。
+    """
+    serials = serials.where((serials >= 0) & (serials <= MAX_EXCEL_SERIAL))
+    return EXCEL_EPOCH + pd.to_timedelta(serials, unit="D")
+
+
+def _parse_date_values(values):
+    """
+    解析日期字符串 / datetime 对象：先按推断的统一格式整列解析，失败的再按混合格式解析。
+    """
+    parsed = pd.to_datetime(values, errors="coerce")
+    retry = parsed.isna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], errors="coerce", format="mixed")
+    return parsed
+
+
+def month_bucket(dates, date_format):
+    """
+    将 datetime64 列按 date_format 分桶，返回分类列（类别按字典序排列，空值为“未知日期”）。
+    只对去重后的日期做格式化，避免逐行 strftime。
+    """
+    codes, uniques = pd.factorize(dates)
+    labels = np.append(pd.DatetimeIndex(uniques).strftime(date_format).to_numpy(dtype=object), UNKNOWN_DATE_LABEL)
+    bucket = labels[np.where(codes < 0, len(labels) - 1, codes)]
+    return pd.Series(
+        pd.Categorical(bucket, categories=sorted(set(bucket))),
+        index=dates.index
+    )
+
+
+def parse_month(text):
+    """
+    校验单个截止月份（YYYY-MM），返回去掉首尾空白后的月份。
+
+    异常:
+    - ValueError: 格式不是 YYYY-MM 或月份不在 01-12
+    """
+    month = text.strip()
+    if not MONTH_PATTERN.fullmatch(month):
+        raise ValueError(f"月份格式应为 YYYY-MM（如 2025-06）：{month}")
+    return month
+
+
+def parse_months(text):
+    """
+    解析以逗号/空格分隔的月份列表（每个均为 YYYY-MM），去重后按时间顺序返回。
+
+    异常:
+    - ValueError: 有格式不对的月份（错误信息中列出全部）
+    """
+    months = [month for month in re.split(r"[,，\s]+", text.strip()) if month]
+    invalid = [month for month in months if not MONTH_PATTERN.fullmatch(month)]
+    if invalid:
+        raise ValueError(f"月份格式应为 YYYY-MM（如 2025-06）：{'、'.join(invalid)}")
+    return sorted(dict.fromkeys(months), key=lambda month: pd.Period(month, freq="M"))
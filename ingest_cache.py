@@ -0,0 +1,245 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+from operator import itemgetter
+import pandas as pd
+from openpyxl import load_workbook
+from config import CONFIG
+from excel_utils import clean_df
+from instrumentation import StageMetrics
+from parallel_utils import map_in_pool
+from path_utils import ensure_private_dir, user_temp_dir
+
+# 缓存格式版本：清洗逻辑变化时递增，使旧缓存自动失效
+CACHE_VERSION = 1
+
+# read_excel_many 中文件总大小低于此值时顺序读取（几个小文件启动进程池的开销大于并行节省的时间）
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+
+
+def _cache_settings():
+    settings = CONFIG.get("ingest_cache", {})
+    return (
+        settings.get("enabled", True),
+        settings.get("dir") or user_temp_dir("pivot_ingest_cache"),
+        settings.get("max_bytes", 512 * 1024 * 1024)
+    )
+
+
+def read_file_bytes(file_obj):
+    """
+    读取上传文件 / BytesIO / 本地文件对象的全部字节（不改变后续读取位置）。
+    """
+    if hasattr(file_obj, "getvalue"):
+        return file_obj.getvalue()
+    file_obj.seek(0)
+    data = file_obj.read()
+    file_obj.seek(0)
+    return data
+
+
+def cache_key(data, **read_kwargs):
+    """
+    以文件内容哈希 + 读取参数 + 缓存版本 + pandas 版本作为缓存键。
+    """
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(read_kwargs, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8"))
+    digest.update(f"v{CACHE_VERSION}/pandas-{pd.__version__}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _load(cache_dir, key):
+    for suffix, reader in ((".parquet", pd.read_parquet), (".pkl", pd.read_pickle)):
+        path = os.path.join(cache_dir, key + suffix)
+        if os.path.exists(path):
+            try:
+                df = reader(path)
+            except Exception:
+                continue
+            os.utime(path)  # 记录最近使用时间，供 LRU 淘汰
+            return df
+    return None
+
+
+def _store(cache_dir, key, df):
+    """
+    优先写 Parquet；列名非字符串、列内类型混杂或读回后类型不一致等情况退回 pickle，
+    保证命中缓存与首次解析得到的 DataFrame 完全一致。
+    先写临时文件再原子替换，避免并发会话读到半个文件。
+    """
+    for suffix in (".parquet", ".pkl"):
+        path = os.path.join(cache_dir, key + suffix)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            if suffix == ".parquet":
+                df.to_parquet(tmp_path)
+                if not pd.read_parquet(tmp_path).dtypes.equals(df.dtypes):
+                    raise TypeError("Parquet 往返后列类型不一致")
+            else:
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+            return path
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return None
+
+
+def evict(cache_dir, max_bytes):
+    """
+    缓存目录超过 max_bytes 时，按最近使用时间从旧到新删除缓存文件。
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith((".parquet", ".pkl")):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def read_excel_columns(data, columns):
+    """
+    只读取第一个工作表中的指定列：openpyxl 只读模式逐行流式读取，每行只保留需要的单元格，
+    不为其余列构建对象，解析内存与未使用的列数成比例下降。
+    表头按原样匹配，匹配不到时按去除首尾空格后的名称匹配；整行为空的行跳过（与 pd.read_excel 一致）。
+
+    参数:
+    - data: 文件字节内容
+    - columns: 需要的列名列表
+
+    返回:
+    - 只含所需列的 DataFrame（列顺序与工作表一致）
+
+    异常:
+    - ValueError: 表头中缺少所需列
+    """
+    wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+
+        positions = {}
+        for position, name in enumerate(header):
+            if name is None:
+                continue
+            for candidate in (name, str(name).strip()):
+                if candidate in columns and candidate not in positions:
+                    positions[candidate] = position
+
+        missing = [col for col in columns if col not in positions]
+        if missing:
+            raise ValueError(f"缺少必要列：{'、'.join(map(str, missing))}")
+
+        names = sorted(positions, key=positions.get)
+        picked = [positions[name] for name in names]
+        width = max(picked) + 1
+        # 单列时 itemgetter 返回标量，统一包成元组
+        getter = itemgetter(*picked) if len(picked) > 1 else (lambda row: (row[picked[0]],))
+
+        records = []
+        for row in rows:
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            record = getter(row)
+            if any(value is not None for value in record):
+                records.append(record)
+    finally:
+        wb.close()
+
+    return pd.DataFrame.from_records(records, columns=names)
+
+
+def read_excel_cached(file_obj, columns=None, metrics=None, source=None, **read_kwargs):
+    """
+    读取并清洗 Excel（pd.read_excel + clean_df），按文件内容哈希缓存清洗结果。
+    相同文件再次上传（或只修改截止月份后重新生成）时直接从本地缓存加载。
+
+    参数:
+    - file_obj: 上传文件 / BytesIO / 本地文件对象
+    - columns: 只读取这些列（见 read_excel_columns），为空时读取全部列
+    - metrics: 记录“查找缓存”（命中时记输出行数）“读取”“清洗”阶段的 StageMetrics，source 为记录中的来源名
+    - read_kwargs: 未指定 columns 时透传给 pd.read_excel 的参数（与 columns 一起参与缓存键计算）
+
+    返回:
+    - 清洗后的 DataFrame（每次返回独立副本，可放心原地修改）
+    """
+    enabled, cache_dir, max_bytes = _cache_settings()
+    metrics = metrics or StageMetrics()
+    data = read_file_bytes(file_obj)
+
+    # 缓存中的 pickle 文件加载时会执行代码，缓存目录只允许当前用户访问；目录不可用或不安全时不使用缓存
+    if enabled:
+        try:
+            ensure_private_dir(cache_dir)
+        except OSError:
+            enabled = False
+
+    if enabled:
+        with metrics.measure("查找缓存", source) as info:
+            key = cache_key(data, columns=columns, **read_kwargs)
+            cached = _load(cache_dir, key)
+            info["rows_out"] = None if cached is None else len(cached)
+        if cached is not None:
+            return cached
+
+    with metrics.measure("读取", source) as info:
+        if columns is not None:
+            raw = read_excel_columns(data, list(columns))
+        else:
+            raw = pd.read_excel(io.BytesIO(data), **read_kwargs)
+        info["rows_out"] = len(raw)
+    with metrics.measure("清洗", source, len(raw)) as info:
+        df = clean_df(raw)
+        info["rows_out"] = len(df)
+    del raw
+
+    if enabled:
+        try:
+            _store(cache_dir, key, df)
+            evict(cache_dir, max_bytes)
+        except OSError:
+            pass  # 缓存目录不可写时不影响正常读取
+
+    return df
+
+
+def _read_excel_bytes(data, read_kwargs):
+    return read_excel_cached(io.BytesIO(data), **read_kwargs)
+
+
+def read_excel_many(files, workers=None, **read_kwargs):
+    """
+    在进程池中并行读取多个 Excel（见 read_excel_cached），按传入顺序返回。
+    文件总大小低于 PARALLEL_MIN_BYTES 时在当前进程顺序读取。
+
+    参数:
+    - files: dict，名称 → 文件字节内容
+    - workers: 进程数，默认见 parallel_utils.resolve_workers
+
+    返回:
+    - dict，名称 → 清洗后的 DataFrame
+    """
+    names = list(files)
+    if sum(len(data) for data in files.values()) < PARALLEL_MIN_BYTES:
+        workers = 1
+    frames = map_in_pool(_read_excel_bytes, [(files[name], read_kwargs) for name in names], workers)
+    return dict(zip(names, frames))
@@ -0,0 +1,166 @@
+import cProfile
+import json
+import marshal
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+MB = 1024 * 1024
+
+# 运行结束时记录的内存占用最多的代码行数
+TOP_ALLOCATIONS = 10
+
+# 性能分析结果中列出的最耗时函数个数
+TOP_FUNCTIONS = 30
+
+
+class StageMetrics:
+    """
+    处理流程各阶段的记录：每个阶段一条（阶段名、来源文件 / sheet、墙钟耗时、CPU 耗时、输入 / 输出行数、峰值内存增量）。
+
+    峰值内存取自 tracemalloc，只在 trace_memory 时开启（开启后执行明显变慢），
+    为阶段内的峰值减去阶段开始时的占用。阶段不嵌套：tracemalloc 的峰值是全局的，内层阶段会重置外层的峰值。
+    子进程中的记录（records）带回主进程后用 extend 合并。
+
+    用法:
+        metrics = StageMetrics(trace_memory=True)
+        with metrics.tracing():
+            with metrics.measure("透视", source="赛卓-未交订单", rows_in=len(df)) as info:
+                pivoted = ...
+                info["rows_out"] = len(pivoted)
+        metrics.to_dict()
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+        self.started = None
+        self.total_seconds = None
+        self.top_allocations = []
+
+    @contextmanager
+    def tracing(self, top=TOP_ALLOCATIONS):
+        """
+        整个流程的计时范围；trace_memory 时开启 tracemalloc（已开启则沿用），
+        结束前记录仍占用内存最多的前 top 行代码（见 top_allocations，为 0 时不记录）。
+        """
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        self.started = datetime.now()
+        wall = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.total_seconds = time.perf_counter() - wall
+            if self.trace_memory and top and tracemalloc.is_tracing():
+                self.top_allocations = [str(stat) for stat in top_allocations(top)]
+            if started_tracing:
+                tracemalloc.stop()
+
+    @contextmanager
+    def measure(self, stage, source=None, rows_in=None):
+        """
+        记录一个阶段；可在块内设置 info["rows_in"] / info["rows_out"]。
+        """
+        info = {"rows_in": rows_in, "rows_out": None}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield info
+        finally:
+            self.records.append({
+                "stage": stage,
+                "source": source,
+                "seconds": time.perf_counter() - wall,
+                "cpu_seconds": time.process_time() - cpu,
+                "rows_in": _count(info["rows_in"]),
+                "rows_out": _count(info["rows_out"]),
+                "peak_mb": (tracemalloc.get_traced_memory()[1] - memory) / MB if tracing else None
+            })
+
+    def extend(self, records):
+        self.records.extend(records)
+
+    def to_dict(self):
+        return {
+            "started": self.started.isoformat(timespec="seconds") if self.started else None,
+            "total_seconds": self.total_seconds,
+            "trace_memory": self.trace_memory,
+            "stages": list(self.records),
+            "top_allocations": list(self.top_allocations)
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+
+class RunProfile:
+    """
+    用 cProfile（确定性分析）记录一次运行中各函数的调用次数和耗时，用于定位阶段内具体慢在哪个函数。
+
+    结果可导出为 .prof 文件（与 cProfile.Profile.dump_stats 格式相同，可用 pstats / snakeviz 查看），
+    并可列出累计耗时最多的函数。分析期间执行会变慢；只在需要时创建，未开启时没有任何开销。
+
+    用法:
+        profile = RunProfile()
+        with profile:
+            processor.process(...)
+        profile.top_functions(20)
+        profile.dump()   # .prof 文件内容
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.disable()
+        return False
+
+    def dump(self):
+        return marshal.dumps(pstats.Stats(self.profiler).stats)
+
+    def top_functions(self, n=TOP_FUNCTIONS, sort="cumulative"):
+        """
+        按 sort（pstats 的排序键，默认累计耗时）排序的前 n 个函数：
+        [{"function", "calls", "primitive_calls", "tottime", "cumtime"}, ...]
+        """
+        stats = pstats.Stats(self.profiler).sort_stats(sort)
+        rows = []
+        for func in stats.fcn_list[:n]:
+            primitive_calls, calls, tottime, cumtime, _ = stats.stats[func]
+            rows.append({
+                "function": pstats.func_std_string(func),
+                "calls": calls,
+                "primitive_calls": primitive_calls,
+                "tottime": tottime,
+                "cumtime": cumtime
+            })
+        return rows
+
+
+def top_allocations(n=5, snapshot=None):
+    """
+    内存占用最多的前 n 行代码（tracemalloc 按行统计）。
+    未开启 tracemalloc 且未传入 snapshot 时返回空列表（此时没有可统计的分配）。
+    """
+    if snapshot is None:
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot()
+    return snapshot.statistics("lineno")[:n]
+
+
+def _count(value):
+    # 行数统一为 int（numpy 整数不能直接写入 JSON）
+    return None if value is None else int(value)
@@ -0,0 +1,260 @@
+import io
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import CONFIG
+from ingest_cache import read_file_bytes
+from parallel_utils import available_cpus, pool_context
+from path_utils import ensure_private_dir, user_temp_dir
+from log_utils import MessageLog
+from pivot_processor import PROCESS_STAGES, PivotProcessor
+
+# 任务状态
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+STATUS_FILE = "status.pkl"
+RESULT_FILE = "report.xlsx"
+PROFILE_FILE = "profile.prof"
+
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class JobLog(MessageLog):
+    """
+    任务进程中的 MessageLog：每条提示和每个完成的阶段都立即写入任务状态文件，供主进程轮询。
+    """
+
+    def __init__(self, job_dir, status):
+        super().__init__()
+        self.job_dir = job_dir
+        self.status = status
+
+    def _add(self, level, message):
+        super()._add(level, message)
+        self.flush()
+
+    def stage(self, name, message=None):
+        super().stage(name, message)
+        self.flush()
+
+    def flush(self):
+        stage = self.stages[-1] if self.stages else None
+        self.status.update(
+            stage=stage,
+            progress=(PROCESS_STAGES.index(stage) + 1) / len(PROCESS_STAGES) if stage in PROCESS_STAGES else 0.0,
+            messages=list(self.messages)
+        )
+        _write_status(self.job_dir, self.status)
+
+
+def run_job(job_dir, uploaded_files, additional_sheets, run_config):
+    """
+    在任务进程中生成报告：阶段进度和提示随时写入状态文件，结果写入 RESULT_FILE，
+    结束时各阶段记录（StageMetrics.to_dict）写入状态的 metrics。
+    开启性能分析时 .prof 文件写入 PROFILE_FILE，耗时最多的函数（RunProfile.top_functions）写入状态的 profile。
+
+    参数:
+    - job_dir: 任务目录
+    - uploaded_files: 内部文件名 → 文件字节内容
+    - additional_sheets: 预测 / 安全库存 / 新旧料号表（DataFrame）
+    - run_config: 本次运行的配置（RunConfig）
+    """
+    status = _read_status(job_dir)
+    status.update(state=RUNNING, started=time.time())
+    log = JobLog(job_dir, status)
+    log.flush()
+
+    buffer = io.BytesIO()
+    processor = PivotProcessor(run_config)
+    try:
+        files = {name: io.BytesIO(data) for name, data in uploaded_files.items()}
+        processor.process(files, buffer, additional_sheets, log)
+    except Exception as e:
+        log.error(f"❌ 生成汇总失败: {e}")
+    status["metrics"] = processor.metrics.to_dict()
+    if processor.profile is not None:
+        _write_atomic(os.path.join(job_dir, PROFILE_FILE), processor.profile.dump())
+        status["profile"] = processor.profile.top_functions()
+
+    data = buffer.getvalue()
+    if data:
+        _write_atomic(os.path.join(job_dir, RESULT_FILE), data)
+        status.update(state=DONE, progress=1.0)
+    else:
+        errors = [message for level, message in log.messages if level == "error"]
+        status.update(state=FAILED, error=errors[-1] if errors else "未生成汇总文件")
+    status["finished"] = time.time()
+    _write_status(job_dir, status)
+
+
+class JobQueue:
+    """
+    后台生成报告的任务队列：任务在本机进程池中执行，不占用 Streamlit 脚本线程。
+
+    提交后返回任务 ID；任务状态（阶段进度、提示信息）和结果文件按任务 ID 存放在任务目录中，
+    浏览器重连或换会话后凭任务 ID 仍可查询进度和下载。各会话共用一个队列（进程池）。
+
+    用法:
+        job_id = queue.submit(uploaded_files, additional_sheets, run_config)
+        queue.status(job_id)   # {"state", "stage", "progress", "messages", "error", "metrics", ...}
+        queue.result(job_id)   # 完成后为 Excel 字节内容
+        queue.profile(job_id)  # 开启性能分析时为 .prof 文件内容
+    """
+
+    def __init__(self, workers=None, jobs_dir=None):
+        settings = CONFIG.get("job_queue", {})
+        self.workers = workers or settings.get("workers") or available_cpus()
+        self.jobs_dir = jobs_dir or settings.get("dir") or user_temp_dir("pivot_jobs")
+        self.max_age = settings.get("max_age_hours", 24) * 3600
+        self.ingest_workers = settings.get("ingest_workers")
+        # 状态文件以 pickle 保存，任务目录只允许当前用户访问
+        ensure_private_dir(self.jobs_dir)
+        self._pool = None
+        self._futures = {}
+        # 各会话在不同的脚本线程中提交任务
+        self._lock = threading.Lock()
+
+    def submit(self, uploaded_files, additional_sheets, run_config):
+        """
+        提交一个生成任务，返回任务 ID。
+
+        参数:
+        - uploaded_files: 内部文件名 → 上传文件（或 BytesIO），提交时读出字节内容
+        - additional_sheets: 预测 / 安全库存 / 新旧料号表（DataFrame）
+        - run_config: 本次运行的配置（RunConfig）
+        """
+        files = {name: read_file_bytes(file_obj) for name, file_obj in uploaded_files.items()}
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+        _write_status(job_dir, {
+            "job_id": job_id, "state": QUEUED, "stage": None, "progress": 0.0, "messages": [],
+            "error": None, "metrics": None, "profile": None, "submitted": time.time(), "started": None, "finished": None
+        })
+
+        with self._lock:
+            self._prune()
+            if run_config.ingest_workers is None:
+                run_config = run_config.replace(ingest_workers=self._ingest_workers())
+            args = (run_job, job_dir, files, additional_sheets or {}, run_config)
+            try:
+                future = self._executor().submit(*args)
+            except BrokenProcessPool:
+                # 任务进程异常退出后进程池不可再用，重建后重新提交
+                self._pool = None
+                future = self._executor().submit(*args)
+            self._futures[job_id] = future
+        return job_id
+
+    def status(self, job_id):
+        """
+        任务状态 dict（state / stage / progress / messages / error / metrics / profile / submitted / started / finished），
+        任务不存在或已清理时返回 None。
+        """
+        job_dir = self._job_dir(job_id)
+        if job_dir is None:
+            return None
+        status = _read_status(job_dir)
+        if status is None:
+            return None
+
+        # 任务进程异常退出时状态文件停在排队 / 运行中，按进程池返回的异常标记为失败
+        future = self._futures.get(job_id)
+        if status["state"] in (QUEUED, RUNNING) and future is not None and future.done() and future.exception():
+            status.update(state=FAILED, error=f"任务进程异常退出: {future.exception()}", finished=time.time())
+            _write_status(job_dir, status)
+        return status
+
+    def result(self, job_id):
+        """
+        已完成任务的 Excel 字节内容，未完成或不存在时返回 None。
+        """
+        status = self.status(job_id)
+        if status is None or status["state"] != DONE:
+            return None
+        with open(os.path.join(self._job_dir(job_id), RESULT_FILE), "rb") as f:
+            return f.read()
+
+    def profile(self, job_id):
+        """
+        已结束任务的性能分析结果（.prof 文件内容），未开启性能分析或不存在时返回 None。
+        """
+        job_dir = self._job_dir(job_id)
+        if job_dir is None:
+            return None
+        try:
+            with open(os.path.join(job_dir, PROFILE_FILE), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context())
+        return self._pool
+
+    def _ingest_workers(self):
+        """
+        单个任务内解析源文件的进程数：CONFIG["job_queue"]["ingest_workers"] 为空时，
+        按提交时同时运行的任务数平分可用 CPU 核数（至少 1），队列空闲时单个任务可用全部核数。
+        """
+        if self.ingest_workers:
+            return self.ingest_workers
+        active = sum(not future.done() for future in self._futures.values())
+        return max(1, available_cpus() // min(active + 1, self.workers))
+
+    def _job_dir(self, job_id):
+        # 任务 ID 来自地址栏参数，只接受 uuid 格式，避免拼出任务目录以外的路径
+        if not isinstance(job_id, str) or not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _prune(self):
+        """
+        删除超过 max_age 的已结束任务目录。
+        """
+        cutoff = time.time() - self.max_age
+        for job_id in os.listdir(self.jobs_dir):
+            future = self._futures.get(job_id)
+            if future is not None and not future.done():
+                continue
+            path = os.path.join(self.jobs_dir, job_id)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+                    self._futures.pop(job_id, None)
+            except OSError:
+                continue
+
+
+def _read_status(job_dir):
+    try:
+        with open(os.path.join(job_dir, STATUS_FILE), "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _write_status(job_dir, status):
+    _write_atomic(os.path.join(job_dir, STATUS_FILE), pickle.dumps(status))
+
+
+def _write_atomic(path, data):
+    # 先写临时文件再替换，轮询方不会读到写了一半的文件
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
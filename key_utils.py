@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+
+# 主键列（晶圆品名, 规格, 品名），所有来源表统一映射到这三个字段
+KEY_COLS = ["晶圆品名", "规格", "品名"]
+
+# 规范化后的组合主键列名
+KEY_COLUMN = "_主键"
+
+# 组合主键各部分之间的分隔符（不会出现在料号中）
+KEY_SEP = "\x1f"
+
+# 需要去除的引号（英文和中文单/双引号）
+QUOTE_PATTERN = r"[\"'‘’“”]"
+
+
+def standardize(val):
+    """
+    将单个值标准化为可比较的字符串，规则与 normalize_key_values 完全一致：
+    - 空值（None / NaN）转为空字符串
+    - 全角空格替换为半角空格
+    - 去除所有中英文引号
+    - 去除首尾空格
+    """
+    return normalize_key_values(pd.Series([val], dtype=object)).iloc[0]
+
+
+def normalize_key_values(values):
+    """
+    向量化地标准化一列主键值（规则见 standardize），返回 object 类型的字符串 Series。
+    """
+    text = pd.Series(values, copy=False).astype("string")
+    text = (
+        text.str.replace("\u3000", " ", regex=False)
+        .str.replace(QUOTE_PATTERN, "", regex=True)
+        .str.strip()
+    )
+    return text.fillna("").astype(object)
+
+
+def normalize_key_columns(df, field_map=None):
+    """
+    返回主键字段的文本列按 normalize_key_values 规范化后的 DataFrame（不修改原表），
+    使 “X”、X　、 X 等写法在替换、分组、透视时归为同一行，与组合主键一致。
+    空值保持为空；数值列不含需去除的字符，保持原类型。
+
+    参数:
+    - field_map: dict，键为 "晶圆品名"/"规格"/"品名"，值为该表中对应的列名；为空时默认列名即为 KEY_COLS
+    """
+    field_map = field_map or {col: col for col in KEY_COLS}
+    df = df.copy()
+    for col in field_map.values():
+        if col not in df.columns:
+            continue
+        series = df[col]
+        if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            continue
+        # 只规范化去重后的取值，再按编码映射回每一行
+        codes, uniques = pd.factorize(series)
+        normalized = np.append(normalize_key_values(pd.Series(uniques, dtype=object)).to_numpy(dtype=object), None)
+        df[col] = pd.Series(normalized[codes], index=series.index, dtype=object)
+    return df
+
+
+def build_key(df, field_map=None):
+    """
+    计算规范化的组合主键 Series（与 df 行一一对应）。
+
+    参数:
+    - df: 任意来源表
+    - field_map: dict，键为 "晶圆品名"/"规格"/"品名"，值为该表中对应的列名；
+                 为空时默认列名即为 KEY_COLS
+    """
+    field_map = field_map or {col: col for col in KEY_COLS}
+    columns = [df[field_map[col]] for col in KEY_COLS]
+    if all(isinstance(col.dtype, pd.CategoricalDtype) for col in columns):
+        return _build_key_from_codes(columns, df.index)
+
+    parts = [normalize_key_values(col) for col in columns]
+    key = parts[0].str.cat(parts[1:], sep=KEY_SEP)
+    key.index = df.index
+    key.name = KEY_COLUMN
+    return key
+
+
+def _build_key_from_codes(columns, index):
+    """
+    主键字段均为分类列时：只规范化各列的类别取值，按编码组合出出现过的主键，
+    返回分类类型的主键 Series（取值与逐行拼接的结果一致）。
+    """
+    combined = np.zeros(len(index), dtype=np.int64)
+    labels = []
+    for col in columns:
+        categories = normalize_key_values(col.cat.categories).to_numpy()
+        # 空值规范化为空字符串，编码 -1 对应追加在末尾的空字符串
+        categories = np.append(categories, "")
+        codes = col.cat.codes.to_numpy(dtype=np.int64)
+        codes = np.where(codes < 0, len(categories) - 1, codes)
+        combined, uniques = pd.factorize(combined * len(categories) + codes)
+        combined = combined.astype(np.int64)
+        labels = [label[uniques // len(categories)] for label in labels] + [categories[uniques % len(categories)]]
+
+    keys = labels[0].astype(object)
+    for label in labels[1:]:
+        keys = keys + KEY_SEP + label
+
+    # 不同类别规范化后可能相同，按主键字符串再去重一次
+    key_codes, categories = pd.factorize(keys)
+    return pd.Series(
+        pd.Categorical.from_codes(key_codes[combined], categories=pd.Index(categories, dtype=object)),
+        index=index, name=KEY_COLUMN
+    )
+
+
+def add_key_column(df, field_map=None):
+    """
+    返回附加了规范化组合主键列 KEY_COLUMN 的 DataFrame（不修改原表）。
+    """
+    df = df.copy()
+    df[KEY_COLUMN] = build_key(df, field_map)
+    return df
+
+
+def ensure_key_column(df, field_map=None):
+    """
+    若 df 已带有 KEY_COLUMN 则直接返回，否则计算后附加。
+    """
+    if KEY_COLUMN in df.columns:
+        return df
+    return add_key_column(df, field_map)
+
+
+class KeyDictionary:
+    """
+    低内存模式下的共享字典：每个主键维度（晶圆品名、规格、品名、仓库名称…）一份类别表，
+    各来源表的同一维度编码为同一类别表上的分类列，分组、透视和连接都在整数编码上进行，
+    只在写出 Excel 时还原为字符串。
+
+    类别表只追加不重排：已编码的列换到最新类别表时编码不变。
+    """
+
+    def __init__(self):
+        self.dtypes = {}
+
+    def encode(self, values, dimension):
+        """
+        将一列编码为 dimension 维度共享类别表上的分类列（新取值追加到类别表末尾）。
+        已是分类列时只换算类别，不逐行还原字符串。
+        """
+        series = pd.Series(values, copy=False)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            uniques = pd.Index(series.cat.categories, dtype=object)
+        else:
+            codes, uniques = pd.factorize(series)
+            uniques = pd.Index(uniques, dtype=object)
+
+        dtype = self.dtypes.get(dimension)
+        categories = dtype.categories if dtype is not None else pd.Index([], dtype=object)
+        new = uniques[categories.get_indexer(uniques) < 0]
+        if dtype is None or len(new):
+            dtype = pd.CategoricalDtype(categories.append(new))
+            self.dtypes[dimension] = dtype
+
+        recode = np.append(dtype.categories.get_indexer(uniques), -1)
+        return pd.Series(
+            pd.Categorical.from_codes(recode[codes], dtype=dtype),
+            index=series.index, name=series.name
+        )
+
+    def encode_columns(self, df, dimensions):
+        """
+        返回将 dimensions（列名 → 维度）中存在的列编码为分类列后的 DataFrame（不修改原表）。
+        """
+        df = df.copy()
+        for col, dimension in dimensions.items():
+            if col in df.columns:
+                df[col] = self.encode(df[col], dimension)
+        return df
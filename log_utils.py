@@ -0,0 +1,87 @@
+import sys
+
+
+class Log:
+    """
+    处理流程的提示与进度输出接口（代替直接调用 st.*）：
+    - success / info / warning / error(message)：各级提示
+    - write(obj)：输出表格等对象
+    - stage(name, message=None)：完成一个处理阶段（见 pivot_processor.PROCESS_STAGES），有提示时按 success 输出
+
+    子类只需实现 _add(level, message)。
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def _add(self, level, message):
+        raise NotImplementedError
+
+    def success(self, message):
+        self._add("success", message)
+
+    def info(self, message):
+        self._add("info", message)
+
+    def warning(self, message):
+        self._add("warning", message)
+
+    def error(self, message):
+        self._add("error", message)
+
+    def write(self, message):
+        self._add("write", message)
+
+    def stage(self, name, message=None):
+        self.stages.append(name)
+        if message:
+            self.success(message)
+
+
+class StreamlitLog(Log):
+    """
+    直接输出到当前 Streamlit 会话（st.success / st.error / st.write ...）。
+    """
+
+    def _add(self, level, message):
+        import streamlit as st
+        getattr(st, level)(message)
+
+
+class MessageLog(Log):
+    """
+    代替 st 收集提示信息（子进程中无法直接调用 st），回到主线程后再按顺序输出。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def _add(self, level, message):
+        self.messages.append((level, message))
+
+
+class ConsoleLog(Log):
+    """
+    命令行输出：每条提示一行（警告和错误写到 stderr），可加前缀区分并行处理的快照。
+    quiet 时只输出警告和错误。
+    """
+
+    def __init__(self, label=None, quiet=False):
+        super().__init__()
+        self.prefix = f"[{label}] " if label else ""
+        self.quiet = quiet
+        self.error_count = 0
+
+    def _add(self, level, message):
+        if level == "error":
+            self.error_count += 1
+        if self.quiet and level not in ("warning", "error"):
+            return
+        stream = sys.stderr if level in ("warning", "error") else sys.stdout
+        print(f"{self.prefix}{message}", file=stream, flush=True)
+
+    def stage(self, name, message=None):
+        super().stage(name, message)
+        if not message and not self.quiet:
+            print(f"{self.prefix}▶ {name}", flush=True)
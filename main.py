@@ -1,19 +1,23 @@
 import streamlit as st
 from io import BytesIO
-from datetime import datetime
-import pandas as pd
-from pivot_processor import PivotProcessor
-from ui import setup_sidebar, get_uploaded_files
+from job_queue import JobQueue
+from ui import setup_sidebar, get_uploaded_files, show_job
 from github_utils import upload_to_github, download_from_github
 from urllib.parse import quote
-from excel_utils import clean_df
+from ingest_cache import read_excel_many
+
+@st.cache_resource
+def get_job_queue():
+    # 各会话共用一个任务队列（进程池），任务状态和结果按任务 ID 存在磁盘上
+    return JobQueue()
+
 
 def main():
     st.set_page_config(page_title="Excel数据透视汇总工具", layout="wide")
     setup_sidebar()
 
     # 获取上传文件
-    uploaded_files, forecast_file, safety_file, mapping_file, start = get_uploaded_files()
+    uploaded_files, forecast_file, safety_file, mapping_file, start, run_config = get_uploaded_files()
 
     # 文件名映射表（上传名 → 处理名）
     rename_mapping = {
@@ -44,12 +48,12 @@ def main():
         }
 
 
-        additional_sheets = {}
+        # 先收集文件内容（上传 / 下载需在主线程中完成），再统一解析（文件较大时才用进程池，见 read_excel_many）
+        additional_bytes = {}
 
         for name, file in github_files.items():
             if file:  # 如果上传了新文件，则保存到 GitHub
                 file_bytes = file.read()
-                file_io = BytesIO(file_bytes)
                 
                 # 对中文文件名进行 URL 编码，避免 GitHub 报 400
                 safe_name = quote(name)
@@ -58,36 +62,32 @@ def main():
                 upload_to_github(BytesIO(file_bytes), safe_name)
 
                 # 保留原始名字作为字典 key
-                df = pd.read_excel(file_io)
-                df = clean_df(df)
-                additional_sheets[name.replace(".xlsx", "")] = df
+                additional_bytes[name] = file_bytes
             else:
                 try:
                     # 下载时也编码文件名
                     safe_name = quote(name)
                     content = download_from_github(safe_name)
 
-                    df = pd.read_excel(BytesIO(content))
-                    df = clean_df(df)
-                    additional_sheets[name.replace(".xlsx", "")] = df
+                    additional_bytes[name] = content
                     st.info(f"📂 使用了 GitHub 上存储的历史版本：{name}")
                 except FileNotFoundError:
                     st.warning(f"⚠️ 未提供且未在 GitHub 找到历史文件：{name}")
+
+        additional_sheets = {
+            name.replace(".xlsx", ""): df
+            for name, df in read_excel_many(additional_bytes).items()
+        }
               
-        # 生成 Excel 汇总
-        buffer = BytesIO()
-        processor = PivotProcessor()
-        processor.process(uploaded_files, buffer, additional_sheets)
-
-        # 提供下载按钮
-        file_name = f"运营数据订单-在制-库存汇总报告_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        st.success("✅ 汇总完成！你可以下载结果文件：")
-        st.download_button(
-            label="📥 下载 Excel 汇总报告",
-            data=buffer.getvalue(),
-            file_name=file_name,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        # 提交后台任务生成 Excel 汇总（本会话的运行配置随任务传入，多个会话可同时生成报告）
+        job_id = get_job_queue().submit(uploaded_files, additional_sheets, run_config)
+
+        # 任务 ID 放在地址栏中，浏览器重连后仍可查看进度和下载
+        st.query_params["job"] = job_id
+
+    job_id = st.query_params.get("job")
+    if job_id:
+        show_job(get_job_queue(), job_id)
 
 
 
@@ -1,61 +1,217 @@
+import numpy as np
 import pandas as pd
+from key_utils import KEY_COLS, KEY_COLUMN, KEY_SEP, build_key, normalize_key_values
 
-def apply_mapping_and_merge(df, mapping_df, field_map, verbose=True):
-    spec_col = field_map["规格"]
-    name_col = field_map["品名"]
-    wafer_col = field_map["晶圆品名"]
+OLD_KEY_FIELDS = {"规格": "旧规格", "品名": "旧品名", "晶圆品名": "旧晶圆品名"}
+NEW_KEY_FIELDS = {"规格": "新规格", "品名": "新品名", "晶圆品名": "新晶圆品名"}
+
+# 替换后的标记列：该行是否由新旧料号映射而来
+MAPPED_FLAG = "_由新旧料号映射"
+
+# 旧料号重复时的处理方式：保留第一条 / 保留最后一条 / 存在冲突（同一旧料号对应不同新料号）时报错
+DUPLICATE_POLICIES = ("first", "last", "error")
+
+
+class MappingIndex:
+    """
+    新旧料号映射索引：每次运行只根据新旧料号表编译一次（旧料号规范化主键 → 映射表行号、新料号取值），
+    之后各来源表调用 apply 时只需一次主键查找，不再重复清洗和合并整张映射表。
+
+    旧料号在索引中唯一，替换始终是多对一连接，来源表行数不会因映射表重复而膨胀。
+    重复的旧料号记录在 duplicates 中，按 duplicate_policy 取舍。
+
+    多级替换（A→B、B→C）在编译时解析为最终料号（A→C），apply 一次查找即得到最终料号；
+    解析出的替换链记录在 chains 中，成环的映射记录在 cycles 中（环上的料号只替换一级）。
+    """
+
+    def __init__(self, mapping_df, duplicate_policy="first", resolve_chains=True):
+        """
+        参数:
+        - mapping_df: 已统一列名的新旧料号表（含 旧/新 规格、品名、晶圆品名）
+        - duplicate_policy: 旧料号重复时的处理方式，见 DUPLICATE_POLICIES
+        - resolve_chains: 是否解析多级替换；为 False 时每个旧料号只替换一级
+
+        异常:
+        - ValueError: duplicate_policy 为 "error" 且同一旧料号对应不同新料号
+        """
+        if duplicate_policy not in DUPLICATE_POLICIES:
+            raise ValueError(f"不支持的重复旧料号处理方式：{duplicate_policy}（可选 {'/'.join(DUPLICATE_POLICIES)}）")
+
+        old_keys = build_key(mapping_df, OLD_KEY_FIELDS)
+        new_keys = build_key(mapping_df, NEW_KEY_FIELDS)
+        self.duplicates = duplicate_report(mapping_df, old_keys, new_keys)
+
+        conflicts = self.duplicates[self.duplicates["冲突"]]
+        if duplicate_policy == "error" and not conflicts.empty:
+            examples = "；".join(
+                "/".join(str(value) for value in row)
+                for row in conflicts[[OLD_KEY_FIELDS[field] for field in KEY_COLS]].head(5).itertuples(index=False)
+            )
+            raise ValueError(f"新旧料号表中有 {len(conflicts)} 个旧料号对应不同新料号，例如：{examples}")
+
+        keep = "last" if duplicate_policy == "last" else "first"
+        rows = np.flatnonzero(~old_keys.duplicated(keep=keep).to_numpy())
+        self._old_keys = pd.Index(old_keys.to_numpy()[rows])
+        self._rows = rows
+
+        # 新料号三个字段都非空的映射行才执行替换
+        self._valid = np.ones(len(mapping_df), dtype=bool)
+        self._new_values = {}
+        for field, col in NEW_KEY_FIELDS.items():
+            values = mapping_df[col]
+            self._valid &= (values.notna() & (values.astype(str).str.strip() != "")).to_numpy()
+            # 替换写入的新料号取规范化后的取值，与来源表中已规范化的主键字段一致
+            self._new_values[field] = normalize_key_values(values).to_numpy(dtype=object)
+
+        # 替换后的规范化主键，直接按行号取出即为 mapped_keys
+        self._new_keys = new_keys.to_numpy()
+
+        # 每个旧料号最终替换到的映射行号
+        if resolve_chains:
+            self._targets, self.chains, self.cycles = self._resolve_chains()
+        else:
+            self._targets = self._rows
+            self.chains = pd.DataFrame(columns=["旧料号", "最终新料号", "替换次数", "替换路径"])
+            self.cycles = pd.DataFrame(columns=["旧料号", "新料号"])
+
+    def _resolve_chains(self):
+        """
+        计算旧料号 → 最终新料号的传递闭包（倍增跳转，O(n log n)），并检测成环的映射。
 
-    for col in [spec_col, name_col, wafer_col]:
-        df[col] = df[col].astype(str).str.strip()
-    for col in ["旧规格", "旧品名", "旧晶圆品名"]:
-        mapping_df[col] = mapping_df[col].astype(str).str.strip()
+        返回:
+        - targets: 与 self._rows 对应的最终映射行号
+        - chains: 多级替换链报告（旧料号、最终新料号、替换次数、替换路径）
+        - cycles: 成环映射报告（旧料号、新料号）
+        """
+        count = len(self._rows)
+        entries = np.arange(count)
+        valid = self._valid[self._rows]
 
-    left_on = [spec_col, name_col, wafer_col]
-    right_on = ["旧规格", "旧品名", "旧晶圆品名"]
+        # 下一跳：本条映射有效，且其新料号又是另一条有效映射的旧料号
+        hop = self._old_keys.get_indexer(self._new_keys[self._rows])
+        hop[~valid | (hop == entries)] = -1
+        hop[hop >= 0] = np.where(valid[hop[hop >= 0]], hop[hop >= 0], -1)
 
-    try:
-        df_merged = df.merge(mapping_df, how="left", left_on=left_on, right_on=right_on)
+        # 末端映射是不动点；倍增 ceil(log2(n)) 次后，能终止的链都已到达末端（hops 为经过的映射条数 - 1）
+        jump = np.where(hop >= 0, hop, entries)
+        hops = (hop >= 0).astype(np.int64)
+        for _ in range(max(count, 1).bit_length()):
+            hops = hops + hops[jump]
+            jump = jump[jump]
+        cyclic = hop[jump] >= 0
 
-        matched = df_merged["新规格"].notna()
-        unmatched_count = (~matched).sum()
+        final = np.where(cyclic, entries, jump)
+        hops[cyclic] = 0
 
-        # 生成布尔掩码：成功被新旧料号替换的行
-        mask_None = (
-            df_merged["新规格"].notna() & (df_merged["新规格"].astype(str).str.strip() != "") &
-            df_merged["新品名"].notna() & (df_merged["新品名"].astype(str).str.strip() != "") &
-            df_merged["新晶圆品名"].notna() & (df_merged["新晶圆品名"].astype(str).str.strip() != "")
-        )
+        display = pd.Series(self._old_keys, copy=False).str.replace(KEY_SEP, " / ", regex=False).to_numpy()
+        new_display = pd.Series(self._new_keys[self._rows], copy=False).str.replace(KEY_SEP, " / ", regex=False).to_numpy()
 
-        df_merged["_由新旧料号映射"] = mask_None  # 标记列 ✅
+        chain_rows = []
+        for start in np.flatnonzero(hops >= 1):
+            path = [start]
+            while hop[path[-1]] >= 0:
+                path.append(hop[path[-1]])
+            chain_rows.append({
+                "旧料号": display[start],
+                "最终新料号": new_display[final[start]],
+                "替换次数": int(hops[start]) + 1,
+                "替换路径": " → ".join([display[entry] for entry in path] + [new_display[path[-1]]])
+            })
+        chains = pd.DataFrame(chain_rows, columns=["旧料号", "最终新料号", "替换次数", "替换路径"])
+        cycles = pd.DataFrame({"旧料号": display[cyclic], "新料号": new_display[cyclic]})
 
-        # 替换字段
-        df_merged.loc[mask_None, spec_col] = df_merged.loc[mask_None, "新规格"]
-        df_merged.loc[mask_None, name_col] = df_merged.loc[mask_None, "新品名"]
-        df_merged.loc[mask_None, wafer_col] = df_merged.loc[mask_None, "新晶圆品名"]
+        return self._rows[final], chains, cycles
 
-        # 删除中间列
-        drop_cols = ["旧规格", "旧品名", "旧晶圆品名", "新规格", "新品名", "新晶圆品名"]
-        df_cleaned = df_merged.drop(columns=[col for col in drop_cols if col in df_merged.columns])
+    def apply(self, df, field_map):
+        """
+        用新料号替换 df 中匹配到旧料号的行，并按主键字段重新分组合并。
 
+        参数:
+        - df: 来源表（不修改原表）
+        - field_map: dict，键为 "晶圆品名"/"规格"/"品名"，值为 df 中对应的列名
+
+        返回:
+        - df_grouped: 替换并按 (规格, 品名, 晶圆品名) 分组后的表，数值列求和，其他列取第一个非空值
+        - mapped_keys: 发生替换的行替换后的规范化组合主键数组（去重）
+        """
+        spec_col = field_map["规格"]
+        name_col = field_map["品名"]
+        wafer_col = field_map["晶圆品名"]
         group_cols = [spec_col, name_col, wafer_col]
-        numeric_cols = df_cleaned.select_dtypes(include="number").columns.tolist()
-        sum_cols = [col for col in numeric_cols if col not in group_cols]
 
-        df_grouped = df_cleaned.groupby(group_cols, as_index=False)[sum_cols].sum()
+        df = df.drop(columns=[KEY_COLUMN], errors="ignore")
+        for col in group_cols:
+            df[col] = df[col].astype(str).str.strip()
+
+        # 旧料号唯一，多对一查找：每个来源行至多对应一条映射（已解析为最终料号）
+        found = self._old_keys.get_indexer(build_key(df, field_map))
+        positions = np.append(self._targets, -1)[found]
+
+        df = df.reset_index(drop=True)
+        mapped = positions >= 0
+        mapped[mapped] = self._valid[positions[mapped]]
+        targets = positions[mapped]
+
+        df[MAPPED_FLAG] = mapped
+        for field in KEY_COLS:
+            df.loc[mapped, field_map[field]] = self._new_values[field][targets]
+
+        mapped_keys = pd.unique(self._new_keys[targets])
+        return _group_by_key_fields(df, group_cols), mapped_keys
+
+
+def duplicate_report(mapping_df, old_keys, new_keys):
+    """
+    统计新旧料号表中重复的旧料号。
+
+    参数:
+    - mapping_df: 新旧料号表
+    - old_keys / new_keys: 与 mapping_df 行对应的旧/新料号规范化组合主键
 
-        other_cols = [col for col in df_cleaned.columns if col not in group_cols + sum_cols]
-        if other_cols:
-            df_first = df_cleaned.groupby(group_cols, as_index=False)[other_cols].first()
-            df_grouped = pd.merge(df_grouped, df_first, on=group_cols, how="left")
+    返回:
+    - DataFrame：旧晶圆品名/旧规格/旧品名（首次出现的取值）、重复次数、新料号数、
+      冲突（同一旧料号对应不同新料号）；无重复时为空表
+    """
+    old_cols = [OLD_KEY_FIELDS[field] for field in KEY_COLS]
+    columns = old_cols + ["重复次数", "新料号数", "冲突"]
 
-        # ✅ 返回主键集合
-        mapped_keys = set(
-            tuple(df_merged.loc[idx, [spec_col, name_col, wafer_col]].values)
-            for idx in df_merged.index[df_merged["_由新旧料号映射"]]
-        )
+    repeated = old_keys.duplicated(keep=False).to_numpy()
+    if not repeated.any():
+        return pd.DataFrame(columns=columns)
 
-        return df_grouped, mapped_keys
+    pairs = pd.DataFrame({"旧": old_keys.to_numpy()[repeated], "新": new_keys.to_numpy()[repeated]})
+    stats = pairs.groupby("旧", sort=False)["新"].agg(["size", "nunique"])
+
+    report = mapping_df.loc[repeated, old_cols].copy()
+    report["旧"] = pairs["旧"].to_numpy()
+    report = report.drop_duplicates("旧").set_index("旧")
+    report["重复次数"] = stats["size"]
+    report["新料号数"] = stats["nunique"]
+    report["冲突"] = report["新料号数"] > 1
+    return report.reset_index(drop=True)[columns]
+
+
+def _group_by_key_fields(df, group_cols):
+    """
+    按主键字段分组：数值列求和，其他列取第一个非空值（列顺序：主键字段、数值列、其他列）。
+    """
+    numeric_cols = df.select_dtypes(include="number").columns.tolist()
+    sum_cols = [col for col in numeric_cols if col not in group_cols]
+    other_cols = [col for col in df.columns if col not in group_cols + sum_cols]
+
+    aggregations = {**{col: "sum" for col in sum_cols}, **{col: "first" for col in other_cols}}
+    if not aggregations:
+        return df[group_cols].drop_duplicates().sort_values(group_cols, ignore_index=True)
+    return df.groupby(group_cols, as_index=False).agg(aggregations)
+
+
+def apply_mapping_and_merge(df, mapping_df, field_map, verbose=True):
+    """
+    用新旧料号表替换 df 的主键字段（见 MappingIndex.apply）。多次调用时请直接复用 MappingIndex。
 
-    except Exception as e:
-        print(f"❌ 替换失败: {e}")
-        return df, set()
+    返回:
+    - df_grouped: 替换并分组后的表
+    - mapped_keys: 发生替换的规范化组合主键集合
+    """
+    df_grouped, mapped_keys = MappingIndex(mapping_df).apply(df, field_map)
+    return df_grouped, set(mapped_keys)
@@ -1,6 +1,6 @@
 import gc
 import streamlit as st
-import tracemalloc
+from instrumentation import top_allocations
 
 def clean_memory(variables: list = []):
     """
@@ -17,12 +17,10 @@ def clean_memory(variables: list = []):
 
 def memory_debug_top_stats(n=5):
     """
-    显示当前内存占用最多的前 n 行代码（用于调试）
+    显示当前内存占用最多的前 n 行代码（用于调试）。
+    只能统计 tracemalloc 开启之后的分配（如勾选“记录峰值内存”生成报告期间），未开启时返回空列表。
     """
-    tracemalloc.start()
-    snapshot = tracemalloc.take_snapshot()
-    top_stats = snapshot.statistics('lineno')
-    return top_stats[:n]
+    return top_allocations(n)
 
 
 def display_debug_memory_stats(n=5):
@@ -31,5 +29,7 @@ def display_debug_memory_stats(n=5):
     """
     st.markdown("### 💾 当前内存使用排行")
     top_stats = memory_debug_top_stats(n)
+    if not top_stats:
+        st.info("ℹ️ 未开启内存追踪（tracemalloc），没有可统计的分配")
     for stat in top_stats:
         st.code(str(stat))
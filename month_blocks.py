@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+from pivot_engine import dedup_names, pivot_blocks
+
+# 历史合并：度量名包含左侧文字的月份列合并为右侧的历史列（先匹配“未交订单数量”）
+HISTORY_COLUMNS = {"未交订单数量": "历史未交订单数量", "订单数量": "历史订单数量"}
+
+# 展开为列时历史列的位置顺序（紧跟在 index 列之后）
+HISTORY_ORDER = ["历史订单数量", "历史未交订单数量"]
+
+
+class MonthBlocks:
+    """
+    按月份分桶的透视结果：每个度量（如“未交订单数量”）是一个 行数 × 月份数 的连续二维数组，
+    配一条有序的月份轴（date_format 格式化后的标签，按字典序排列）。
+
+    历史合并、合计、列顺序都在数组上按切片 / 累加完成，不再按列名匹配；
+    只在写出或需要 DataFrame 时才展开为“度量_月份”命名列（见 to_frame）。
+
+    合并历史不改动数组，只记录截止月份：截止月份及之前是月份轴的前段，
+    历史数量取自按月累加的数组（各截止月份共用，只计算一次），其余月份为数组切片。
+    """
+
+    def __init__(self, keys, months, blocks, cutoff=None, cumulative=None):
+        """
+        参数:
+        - keys: 每行的 index 取值（DataFrame）
+        - months: dict，度量 → 月份轴（有序标签数组）
+        - blocks: dict，度量 → 二维数组（行与 keys 对应，列与月份轴对应）
+        - cutoff: 历史截止月份（None 表示不合并历史）
+        - cumulative: 按月累加数组的缓存（同一透视结果的各截止月份共用）
+        """
+        self.keys = keys.reset_index(drop=True)
+        self.months = months
+        self.blocks = blocks
+        self.cutoff = cutoff
+        self._cumulative = {} if cumulative is None else cumulative
+
+    @classmethod
+    def pivot(cls, df, index, columns, values):
+        """
+        按 index 各列和月份列 columns 对 values 求和（见 pivot_engine.pivot_blocks）。
+        """
+        values = sorted(values, key=str)
+        keys, labels, blocks = pivot_blocks(df, index, columns, values)
+        return cls(keys, {value: labels for value in values}, blocks)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def with_keys(self, keys):
+        """
+        返回替换了 index 取值（行数不变）的新对象，月份数组共用。
+        """
+        return MonthBlocks(keys, self.months, self.blocks, self.cutoff, self._cumulative)
+
+    def fold_history(self, selected_month):
+        """
+        将 <= selected_month 的月份合并为历史列（见 HISTORY_COLUMNS），返回新对象（数组共用）。
+        """
+        return MonthBlocks(self.keys, self.months, self.blocks, selected_month, self._cumulative)
+
+    def sweep(self, cutoffs):
+        """
+        多个截止月份各自合并历史的结果列表（共用同一份数组和累加结果）。
+        """
+        return [self.fold_history(month) for month in cutoffs]
+
+    def _cut(self, measure):
+        """
+        度量的历史月份数：截止月份在月份轴上的位置（不合并历史的度量为 0）。
+        """
+        if not self.cutoff or history_name(measure) is None:
+            return 0
+        labels = np.asarray(self.months[measure]).astype(str)
+        return int(np.searchsorted(labels, self.cutoff, side="right"))
+
+    def _history_sum(self, measure, cut):
+        if measure not in self._cumulative:
+            self._cumulative[measure] = np.cumsum(self.blocks[measure], axis=1)
+        return self._cumulative[measure][:, cut - 1]
+
+    @property
+    def history(self):
+        """
+        dict：历史列名 → 每行的历史数量（截止月份及之前各月之和）；没有历史月份的列不出现。
+        """
+        history = {}
+        for measure in self.blocks:
+            cut = self._cut(measure)
+            if cut == 0:
+                continue
+            name = history_name(measure)
+            folded = self._history_sum(measure, cut)
+            history[name] = history[name] + folded if name in history else folded
+        return history
+
+    def remaining(self, measure):
+        """
+        度量截止月份之后的月份轴和数组切片。
+        """
+        cut = self._cut(measure)
+        return self.months[measure][cut:], self.blocks[measure][:, cut:]
+
+    def measure_columns(self, measure):
+        """
+        某度量的各列（历史列在前，其后按月份），返回 dict：列名 → 一维数组。
+        """
+        columns = {}
+        cut = self._cut(measure)
+        if cut:
+            columns[history_name(measure)] = self._history_sum(measure, cut)
+        months, block = self.remaining(measure)
+        for position, month in enumerate(months):
+            columns[f"{measure}_{month}"] = block[:, position]
+        return columns
+
+    def total(self, measure):
+        """
+        某度量每行的合计（全部月份之和，与截止月份无关）。
+        """
+        return self.blocks[measure].sum(axis=1)
+
+    def to_frame(self):
+        """
+        展开为 DataFrame：index 列，历史列（历史订单数量、历史未交订单数量），各度量按月份排列的“度量_月份”列。
+        """
+        names, parts = [], []
+        for measure in self.blocks:
+            months, block = self.remaining(measure)
+            names += [f"{measure}_{month}" for month in months]
+            parts.append(pd.DataFrame(block))
+        wide = pd.concat(parts, axis=1, ignore_index=True) if parts else pd.DataFrame(index=range(len(self)))
+        wide.columns = dedup_names(names)
+
+        frame = pd.concat([self.keys, wide], axis=1)
+        history = self.history
+        if not history:
+            return frame
+
+        ordered = list(frame.columns)
+        for offset, name in enumerate(HISTORY_ORDER):
+            if name in history:
+                frame[name] = history[name]
+                ordered.insert(len(self.keys.columns) + offset, name)
+        return frame[ordered]
+
+
+def history_name(measure):
+    """
+    度量对应的历史列名（见 HISTORY_COLUMNS），不合并历史的度量返回 None。
+    """
+    for text, name in HISTORY_COLUMNS.items():
+        if text in str(measure):
+            return name
+    return None
@@ -0,0 +1,62 @@
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import CONFIG
+
+
+def resolve_workers(task_count, workers=None):
+    """
+    计算实际使用的进程数：workers 为空时取 CONFIG["ingest_workers"]，再为空时取可用 CPU 核数，
+    且不超过任务数。
+    """
+    if workers is None:
+        workers = CONFIG.get("ingest_workers")
+    if workers is None:
+        workers = available_cpus()
+    return max(1, min(int(workers), task_count))
+
+
+def available_cpus():
+    """
+    当前进程可用的 CPU 核数（容器中以进程可用的 CPU 为准）。
+    """
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+
+def pool_context():
+    """
+    进程池的启动方式。Streamlit 服务是多线程的，fork 出的子进程可能继承其他线程持有的锁而死锁，
+    因此不用默认的 fork：优先 forkserver（预先导入处理模块，之后各子进程从它 fork，启动开销小；
+    预先导入在以程序目录为工作目录运行时生效），不支持时用 spawn。
+    模块级函数及其参数按 pickle 传入子进程，子进程不继承主进程运行时对 CONFIG 的修改。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["pivot_processor"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def map_in_pool(func, args_list, workers=None):
+    """
+    在进程池中并行执行 func(*args)，按 args_list 的顺序返回结果。
+    只有一个任务或 workers <= 1 时直接在当前进程顺序执行；进程池不可用时退回顺序执行。
+
+    参数:
+    - func: 模块级函数（需可被 pickle）
+    - args_list: 每个任务的参数元组列表
+    - workers: 进程数，默认见 resolve_workers
+    """
+    args_list = list(args_list)
+    workers = resolve_workers(len(args_list), workers)
+    if workers <= 1:
+        return [func(*args) for args in args_list]
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+            futures = [pool.submit(func, *args) for args in args_list]
+            return [future.result() for future in futures]
+    except (BrokenProcessPool, pickle.PicklingError, OSError):
+        return [func(*args) for args in args_list]
@@ -0,0 +1,32 @@
+import os
+import stat
+import tempfile
+
+
+def user_temp_dir(name):
+    """
+    系统临时目录下当前用户专用的目录路径（如 /tmp/pivot_jobs-1000），不同用户互不共用。
+    """
+    owner = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), f"{name}-{owner}")
+
+
+def ensure_private_dir(path):
+    """
+    创建（或校验已有的）只有当前用户可访问的目录（权限 0o700），返回 path。
+
+    目录中的文件会被反序列化加载（任务状态、解析缓存），其他用户若能写入即可执行任意代码，
+    因此已存在的目录必须是当前用户所有的真实目录（不能是符号链接），组 / 其他用户的权限会被收回。
+
+    异常:
+    - PermissionError: 路径是符号链接、不是目录，或属于其他用户
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if stat.S_ISLNK(info.st_mode) or not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"`{path}` 不是目录")
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"`{path}` 属于其他用户，拒绝使用")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
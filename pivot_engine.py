@@ -0,0 +1,213 @@
+import numpy as np
+import pandas as pd
+
+
+def pivot_from_config(df, config):
+    """
+    按 CONFIG["pivot_config"] 中单个文件的配置透视（见 pivot_sum），并展平为一行一个主键的宽表。
+
+    参数:
+    - df: 源数据（含 config 中 index / columns / values 列）
+    - config: {"index": [...], "columns": 列名, "values": [...], "aggfunc": "sum"}；
+              含 date_format 时 columns 应已替换为对应的“_年月”列
+
+    返回:
+    - DataFrame：index 各列 + “数值列_列取值”，缺失组合填 0
+    """
+    return pivot_sum(df, config["index"], config["columns"], config["values"], config.get("aggfunc", "sum"))
+
+
+def pivot_sum(df, index, columns, values, aggfunc="sum"):
+    """
+    等价于 pd.pivot_table(df, index, columns, values, aggfunc, fill_value=0, observed=True).reset_index()
+    再展平列名，但先把 index / columns 各列编码为整数（排序后的分类编码），只在整数编码上分组：
+    数值列求和时直接按 (组, 列) 编号累加到二维数组，不经过 groupby 和 unstack。
+
+    - 任一 index / columns 列为空值的行不参与透视（与 pivot_table 的 dropna 一致）
+    - 行按 index 各列取值排序，列按 (数值列名, 列取值) 排序
+    - 列名为 “数值列_列取值”，重名时依次加 “.1”“.2” 后缀
+    """
+    values = sorted(values, key=str)
+    if aggfunc == "sum" and all(is_summable(df[col]) for col in values):
+        keys, labels, blocks = pivot_blocks(df, index, columns, values)
+        names = [f"{value}_{label}" for value in values for label in labels]
+        wide = pd.concat([pd.DataFrame(block) for block in blocks.values()], axis=1, ignore_index=True) if blocks else pd.DataFrame(index=range(len(keys)))
+        wide.columns = dedup_names(names)
+        return pd.concat([keys, wide], axis=1)
+
+    codes = _pivot_codes(df, index, columns)
+    frame = df[values].iloc[codes.rows].reset_index(drop=True)
+    frame["_组"] = codes.group_ids
+    frame["_列"] = codes.column_ids
+    wide = frame.groupby(["_组", "_列"], sort=True).agg(aggfunc).unstack("_列", fill_value=0)
+    wide = wide.reindex(columns=sorted(wide.columns, key=lambda col: (str(col[0]), col[1])))
+    names = [f"{value}_{codes.column_labels[code]}" for value, code in wide.columns]
+    wide = wide.reset_index(drop=True)
+    wide.columns = dedup_names(names)
+    return pd.concat([codes.keys(df, index), wide], axis=1)
+
+
+def pivot_blocks(df, index, columns, values):
+    """
+    按 (index 各列, columns 列) 求和，每个数值列得到一个 组数 × 列取值数 的二维数组（不展开为列）。
+
+    返回:
+    - keys: 每组的 index 取值（DataFrame，行按 index 各列取值排序）
+    - labels: 实际出现的列取值（已排序的数组）
+    - blocks: dict，数值列名 → 二维数组（整数/布尔列为 int64，其余为 float64）
+    """
+    codes = _pivot_codes(df, index, columns)
+    cells = codes.group_ids * len(codes.column_labels) + codes.column_ids
+    blocks = {}
+    for value in values:
+        block = _sum_by_cell(df[value].to_numpy()[codes.rows], cells, codes.group_count, len(codes.column_labels))
+        blocks[value] = np.ascontiguousarray(block[:, codes.observed])
+    return codes.keys(df, index), codes.column_labels[codes.observed], blocks
+
+
+class _PivotCodes:
+    """
+    透视用的整数编码：参与透视的行号、每行的组编号和列编号、每组第一行的行号。
+    """
+
+    def __init__(self, rows, group_ids, group_count, first, column_ids, column_labels, observed):
+        self.rows = rows
+        self.group_ids = group_ids
+        self.group_count = group_count
+        self.first = first
+        self.column_ids = column_ids
+        self.column_labels = column_labels
+        self.observed = observed
+
+    def keys(self, df, index):
+        return df[list(index)].iloc[self.first].reset_index(drop=True)
+
+
+def _pivot_codes(df, index, columns):
+    index = list(index)
+
+    # 先按出现顺序编码（比排序编码快），分组后只对组和列取值排序
+    index_codes, index_labels = zip(*(_codes(df[col]) for col in index))
+    column_codes, column_labels = _codes(df[columns])
+
+    keep = column_codes >= 0
+    for codes in index_codes:
+        keep &= codes >= 0
+    rows = np.flatnonzero(keep)
+
+    group_ids, group_count = _combine_codes([codes[rows] for codes in index_codes])
+
+    # 每组第一行，用于取 index 取值和排序
+    first = np.zeros(group_count, dtype=np.int64)
+    first[group_ids[::-1]] = np.arange(len(rows))[::-1]
+
+    # 组按 index 各列取值的字典序排列
+    order = np.lexsort([
+        _label_ranks(labels)[codes[rows][first]]
+        for codes, labels in zip(index_codes[::-1], index_labels[::-1])
+    ]) if group_count else np.zeros(0, dtype=np.int64)
+    group_ids = _inverse(order)[group_ids]
+    first = rows[first[order]]
+
+    # 列取值排序，只保留实际出现的取值
+    column_order = np.argsort(_label_ranks(column_labels), kind="stable")
+    column_ids = _inverse(column_order)[column_codes[rows]]
+    column_labels = column_labels[column_order]
+    observed = np.flatnonzero(np.bincount(column_ids, minlength=len(column_labels)))
+
+    return _PivotCodes(rows, group_ids, group_count, first, column_ids, column_labels, observed)
+
+
+def is_summable(values):
+    return pd.api.types.is_numeric_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype)
+
+
+def _sum_by_cell(values, cells, group_count, column_count):
+    """
+    按 (组, 列) 编号累加一列数值，返回 group_count × column_count 的二维数组（空值按 0 计）。
+    整数/布尔列返回 int64，其余返回 float64。
+    """
+    integer = values.dtype.kind in "biu"
+    weights = values.astype(np.float64)
+    if not integer:
+        weights = np.nan_to_num(weights, nan=0.0)
+    block = np.bincount(cells, weights=weights, minlength=group_count * column_count)
+    block = block.reshape(group_count, column_count)
+    return block.astype(np.int64) if integer else block
+
+
+def _codes(values):
+    """
+    按出现顺序的整数编码（空值为 -1）和对应取值；分类列直接使用分类编码，不再逐行哈希取值。
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(dtype=np.int64), np.asarray(values.cat.categories, dtype=object)
+    codes, uniques = pd.factorize(values)
+    return codes, np.asarray(uniques, dtype=object)
+
+
+def _label_ranks(labels):
+    """
+    取值的排序名次；取值类型混杂无法排序时保持原顺序。
+    """
+    try:
+        order = np.argsort(labels, kind="stable")
+    except TypeError:
+        order = np.arange(len(labels))
+    return _inverse(order)
+
+
+def _inverse(order):
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = np.arange(len(order))
+    return inverse
+
+
+def _combine_codes(code_arrays):
+    """
+    将多列编码合并为一列稠密的组编号（0..组数-1，按出现顺序）。
+    各列基数之积超出 int64 时逐列合并并重新编码。
+
+    返回:
+    - group_ids: 每行的组编号
+    - group_count: 组数
+    """
+    if not code_arrays or not len(code_arrays[0]):
+        return np.zeros(0, dtype=np.int64), 0
+
+    limit = np.iinfo(np.int64).max
+    combined = code_arrays[0].astype(np.int64)
+    span = int(combined.max()) + 1
+    for codes in code_arrays[1:]:
+        size = int(codes.max()) + 1
+        if span * size > limit:
+            combined, uniques = pd.factorize(combined)
+            span = len(uniques)
+        combined = combined * size + codes
+        span *= size
+
+    group_ids, uniques = pd.factorize(combined)
+    return group_ids, len(uniques)
+
+
+def dedup_names(names):
+    """
+    列名去重：重复出现的名称依次改为 “名称.1”“名称.2”…（跳过已存在的名称），顺序不变。
+    """
+    seen = set(names)
+    counts = {}
+    result = []
+    for name in names:
+        if name in counts:
+            count = counts[name]
+            candidate = f"{name}.{count}"
+            while candidate in seen:
+                count += 1
+                candidate = f"{name}.{count}"
+            counts[name] = count + 1
+            seen.add(candidate)
+            result.append(candidate)
+        else:
+            counts[name] = 1
+            result.append(name)
+    return result
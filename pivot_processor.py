@@ -1,256 +1,467 @@
-import os
-import re
+import io
+import math
+from contextlib import nullcontext
 import pandas as pd
-import streamlit as st
-from datetime import datetime, timedelta
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment, Font, PatternFill
-from openpyxl import load_workbook
-from config import CONFIG, REVERSE_MAPPING
-from excel_utils import (
-    adjust_column_width,
-    clean_df,
-    merge_header_for_summary, 
-    mark_unmatched_keys_on_sheet,
-    mark_keys_on_sheet,
-    merge_duplicate_product_names
-)
-from mapping_utils import apply_mapping_and_merge
+from config import REVERSE_MAPPING, FIELD_MAPPINGS
+from excel_utils import MAPPED_FILL, UNMATCHED_FILL, merge_duplicate_product_names
+from date_utils import month_bucket, to_datetime_column
+from ingest_cache import read_excel_cached, read_file_bytes
+from instrumentation import RunProfile, StageMetrics
+from log_utils import MessageLog, StreamlitLog
+from key_utils import KEY_COLS, KEY_COLUMN, KeyDictionary, add_key_column, build_key, ensure_key_column, normalize_key_columns
+from mapping_utils import MappingIndex
+from month_blocks import MonthBlocks
+from parallel_utils import map_in_pool
+from pivot_engine import is_summable, pivot_from_config
+from reconcile_utils import KeyReconciler
+from report_writer import StreamingReportWriter
+from run_config import RunConfig
 from month_selector import process_history_columns
 from summary import (
+    UNFULFILLED_BLOCK,
+    SummaryAssembler,
+    cutoff_comparison,
+    unfulfilled_summary_columns,
+    unfulfilled_totals,
     merge_safety_inventory,
     append_unfulfilled_summary_columns,
     append_forecast_to_summary,
     merge_finished_inventory,
-    append_product_in_progress
+    append_product_in_progress,
+    semi_finished_keys
 )
 
-FIELD_MAPPINGS = {
-    "unfulfilled_orders": {"规格": "规格", "品名": "品名", "晶圆品名": "晶圆品名"},
-    "finished_products": {"规格": "产品规格", "品名": "产品品名", "晶圆品名": "晶圆型号"},
-    "finished_inventory": {"规格": "规格", "品名": "品名", "晶圆品名": "WAFER品名"},
-    "safety": {"规格": "OrderInformation", "品名": "ProductionNO.", "晶圆品名": "WaferID"},
-    "forecast": {"规格": "产品型号", "品名": "ProductionNO.", "晶圆品名": "晶圆品名"}
-}
+# 多截止月份对比（长表）的 sheet 名
+CUTOFF_COMPARISON_SHEET = "截止月份对比"
+
+# process 依次经过的阶段（未上传的来源等会跳过对应阶段），完成一个阶段时通过 log.stage 上报
+PROCESS_STAGES = [
+    "解析源文件", "合并安全库存", "合并未交订单", "合并预测数据", "合并成品库存",
+    "合并成品在制", "多截止月份对比", "标记未匹配项", "写出 Excel"
+]
+
+MAPPING_COLUMNS = [
+    "旧规格", "旧品名", "旧晶圆品名",
+    "新规格", "新品名", "新晶圆品名",
+    "封装厂", "PC", "半成品"
+]
+
+
+def required_columns(filename, run_config):
+    """
+    源文件实际用到的列：透视的 index / columns / values，加上新旧料号替换用到的主键列。
+    按首次出现顺序去重；未配置的文件返回 None（读取全部列）。
+    """
+    config = run_config.pivot_config_for(filename)
+    if not config:
+        return None
+
+    columns = list(config["index"]) + [config["columns"]] + list(config["values"])
+    columns += list(FIELD_MAPPINGS.get(filename.replace(".xlsx", ""), {}).values())
+    return list(dict.fromkeys(columns))
+
+
+def key_dimensions(filename, run_config):
+    """
+    低内存模式下需编码的列及其所属维度：透视的 index 列和非日期的 columns 列。
+    主键列按 FIELD_MAPPINGS 归入 晶圆品名/规格/品名 维度（各来源共享同一字典），其余列以列名为维度。
+    """
+    config = run_config.pivot_config_for(filename)
+    if not config:
+        return {}
+
+    field_dimensions = {}
+    for field_map in FIELD_MAPPINGS.values():
+        for field, col in field_map.items():
+            field_dimensions.setdefault(col, field)
+    field_dimensions.update({col: field for field, col in FIELD_MAPPINGS.get(filename.replace(".xlsx", ""), {}).items()})
+
+    columns = list(config["index"])
+    if "date_format" not in config:
+        columns.append(config["columns"])
+    return {col: field_dimensions.get(col, col) for col in columns}
+
+
+def drop_zero_value_rows(df, value_cols):
+    """
+    删除所有数值列均为 0 或空值的行（这些行对透视求和没有贡献）。
+    """
+    values = df[value_cols].apply(pd.to_numeric, errors="coerce")
+    return df[values.fillna(0).ne(0).any(axis=1)]
+
+
+def ingest_source(filename, data, run_config, mapping_index=None):
+    """
+    单个源文件的处理流程：读取 → 清洗 → 主键规范化 → 新旧料号替换 → 日期处理 → 透视。
+    各文件之间互不依赖，可在进程池中并行执行。
+
+    参数:
+    - filename: 内部文件名（如 "unfulfilled_orders.xlsx"）
+    - data: 文件字节内容
+    - run_config: 本次运行的配置（RunConfig）
+    - mapping_index: 新旧料号映射索引（MappingIndex，无映射表时为 None）
+
+    返回:
+    - dict: filename / pivoted（透视结果）/ df（仅未交订单返回替换后的明细）/
+            mapped_keys / messages（待输出的提示）/ metrics（各阶段记录，见 StageMetrics.records）/ error
+    """
+    log = MessageLog()
+    metrics = StageMetrics(run_config.profile_memory)
+    result = {
+        "filename": filename, "pivoted": None, "df": None, "mapped_keys": set(),
+        "messages": log.messages, "metrics": metrics.records, "error": None
+    }
+
+    # 在子进程中执行时需在子进程内开启 tracemalloc；内存占用排行只在整个流程结束时记录
+    with metrics.tracing(top=0):
+        try:
+            config = run_config.pivot_config_for(filename)
+            if not config:
+                log.warning(f"⚠️ 跳过未配置的文件：{filename}")
+                return result
+
+            sheet_key = filename.replace(".xlsx", "")[:30]
+            source = REVERSE_MAPPING.get(sheet_key, sheet_key)
+            df = read_excel_cached(io.BytesIO(data), columns=required_columns(filename, run_config), metrics=metrics, source=source)
+            if run_config.drop_zero_rows:
+                with metrics.measure("删除全零行", source, len(df)) as info:
+                    df = drop_zero_value_rows(df, config["values"])
+                    info["rows_out"] = len(df)
+
+            # 主键字段先规范化，同一主键的不同写法在替换和透视时合并为一行（与汇总的组合主键一致）
+            if sheet_key in FIELD_MAPPINGS:
+                with metrics.measure("规范化主键", source, len(df)) as info:
+                    df = normalize_key_columns(df, FIELD_MAPPINGS[sheet_key])
+                    info["rows_out"] = len(df)
+
+            if sheet_key in FIELD_MAPPINGS and mapping_index is not None:
+                log.success(f"✅ `{sheet_key}` 正在进行新旧料号替换...")
+                with metrics.measure("新旧料号替换", source, len(df)) as info:
+                    df, result["mapped_keys"] = mapping_index.apply(df, FIELD_MAPPINGS[sheet_key])
+                    info["rows_out"] = len(df)
+
+            if run_config.low_memory:
+                with metrics.measure("字典编码", source, len(df)) as info:
+                    df = KeyDictionary().encode_columns(df, key_dimensions(filename, run_config))
+                    info["rows_out"] = len(df)
+
+            with metrics.measure("透视", source, len(df)) as info:
+                processor = PivotProcessor(run_config)
+                if "date_format" in config:
+                    df = processor._process_date_column(df, config["columns"], config["date_format"])
+                result["pivoted"] = processor._create_pivot(df, config, run_config.selected_month, log)
+                info["rows_out"] = len(result["pivoted"])
+            if sheet_key == "unfulfilled_orders":
+                result["df"] = df
+
+        except Exception as e:
+            result["error"] = str(e)
+
+    return result
+
 
 class PivotProcessor:
-    def process(self, uploaded_files: dict, output_buffer, additional_sheets: dict = None):
+    def __init__(self, run_config=None):
+        """
+        参数:
+        - run_config: 本次运行的配置（RunConfig），为空时按 CONFIG 的默认值创建
+        """
+        self.run_config = run_config or RunConfig.from_config()
+        # 最近一次 process 的各阶段记录，以及开启 run_config.profile_run 时的性能分析结果（RunProfile）
+        self.metrics = StageMetrics()
+        self.profile = None
+
+    def process(self, uploaded_files: dict, output_buffer, additional_sheets: dict = None, log=None):
+        """
+        生成汇总报告写入 output_buffer。
+
+        参数:
+        - uploaded_files: 内部文件名 → 上传文件（或 BytesIO）
+        - output_buffer: 写出 Excel 的缓冲区
+        - additional_sheets: 预测 / 安全库存 / 新旧料号表（DataFrame）
+        - log: 提示信息和阶段进度的输出（见 log_utils.Log），默认直接输出到 st
+
+        各阶段的耗时、行数（run_config.profile_memory 时另有峰值内存）记录在 self.metrics 中，
+        run_config.profile_run 时整个过程的性能分析结果在 self.profile 中。
+        """
+        self.metrics = StageMetrics(self.run_config.profile_memory)
+        self.profile = RunProfile() if self.run_config.profile_run else None
+        with self.metrics.tracing(), self.profile or nullcontext():
+            self._process(uploaded_files, output_buffer, additional_sheets or {}, log or StreamlitLog())
+
+    def _process(self, uploaded_files, output_buffer, additional_sheets, log):
+        run_config = self.run_config
+        metrics = self.metrics
         df_finished = pd.DataFrame()
         product_in_progress = pd.DataFrame()
         df_unfulfilled = pd.DataFrame()
 
-        unmatched_safety = []
-        unmatched_unfulfilled = []
-        unmatched_forecast = []
-        unmatched_finished = []
-        unmatched_in_progress = []
-
-        key_safety = []
-        key_unfulfilled = []
-        key_forecast = []
-        key_finished = []
-        key_in_progress = []
-
         mapping_df = additional_sheets.get("mapping", pd.DataFrame())
+        if not mapping_df.empty:
+            mapping_df.columns = MAPPING_COLUMNS + list(mapping_df.columns[9:])
+
+        # 新旧料号映射只编译一次，供各源文件与成品库存/成品在制复用
+        mapping_index = None
+        if not mapping_df.empty:
+            policy = run_config.mapping_duplicate_policy
+            try:
+                with metrics.measure("编译新旧料号表", "赛卓-新旧料号", len(mapping_df)):
+                    mapping_index = MappingIndex(mapping_df, policy, run_config.resolve_mapping_chains)
+            except ValueError as e:
+                log.error(f"❌ 新旧料号表校验失败: {e}")
+                return
+            duplicates = mapping_index.duplicates
+            if not duplicates.empty:
+                log.warning(
+                    f"⚠️ 新旧料号表中有 {len(duplicates)} 个旧料号重复"
+                    f"（其中 {int(duplicates['冲突'].sum())} 个对应不同新料号），已按 `{policy}` 只保留一条"
+                )
+                log.write(duplicates)
+            if not mapping_index.chains.empty:
+                log.info(f"🔗 新旧料号中有 {len(mapping_index.chains)} 个旧料号经多级替换，已直接替换为最终料号")
+                log.write(mapping_index.chains)
+            if not mapping_index.cycles.empty:
+                log.warning(f"⚠️ 新旧料号中有 {len(mapping_index.cycles)} 条映射成环或指向环，这些料号只替换一级")
+                log.write(mapping_index.cycles)
 
         all_mapped_keys = set()
 
-        with pd.ExcelWriter(output_buffer, engine="openpyxl") as writer:
-            for filename, file_obj in uploaded_files.items():
-                try:
-                    df = pd.read_excel(file_obj)
-                    df = clean_df(df)
-                    config = CONFIG["pivot_config"].get(filename)
-                    if not config:
-                        st.warning(f"⚠️ 跳过未配置的文件：{filename}")
-                        continue
+        # 低内存模式：各来源的文本维度换算到同一份共享字典
+        dictionary = KeyDictionary() if run_config.low_memory else None
+
+        # 每个写入 sheet 的规范化主键列（与数据行一一对应），供标色复用
+        sheet_row_keys = {}
+
+        # 各源文件并行读取、清洗、替换、透视，结果按上传顺序写入；
+        # 性能分析只覆盖当前进程，开启时改为顺序处理
+        results = map_in_pool(
+            ingest_source,
+            [
+                (filename, read_file_bytes(file_obj), run_config, mapping_index)
+                for filename, file_obj in uploaded_files.items()
+            ],
+            1 if run_config.profile_run else run_config.ingest_workers
+        )
+        log.stage("解析源文件")
+
+        # 各 sheet 先登记写出计划，退出时流式写出（见 report_writer）
+        with StreamingReportWriter(output_buffer, run_config.highlight_style, metrics) as writer:
+            for result in results:
+                filename = result["filename"]
+                metrics.extend(result["metrics"])
+                for level, message in result["messages"]:
+                    getattr(log, level)(message)
+
+                if result["error"] is not None:
+                    log.error(f"❌ 文件 `{filename}` 处理失败: {result['error']}")
+                    continue
+                if result["pivoted"] is None:
+                    continue
 
+                try:
                     sheet_key = filename.replace(".xlsx", "")[:30]
                     sheet_name = REVERSE_MAPPING.get(sheet_key, sheet_key)
-
-                    if sheet_key in FIELD_MAPPINGS and not mapping_df.empty:
-                        mapping_df.columns = [
-                            "旧规格", "旧品名", "旧晶圆品名",
-                            "新规格", "新品名", "新晶圆品名",
-                            "封装厂", "PC", "半成品"
-                        ] + list(mapping_df.columns[9:])
-                        st.success(f"✅ `{sheet_key}` 正在进行新旧料号替换...")
-                        
-
-                        if sheet_key == "unfulfilled_orders":
-                            df, key_unfulfilled = apply_mapping_and_merge(df, mapping_df, FIELD_MAPPINGS[sheet_key])
-                            all_mapped_keys.update(key_unfulfilled)
-                        elif sheet_key == "finished_inventory":
-                            df, key_finished = apply_mapping_and_merge(df, mapping_df, FIELD_MAPPINGS[sheet_key])
-                            all_mapped_keys.update(key_finished)
-                        elif sheet_key == "finished_products":
-                            df, key_in_progress = apply_mapping_and_merge(df, mapping_df, FIELD_MAPPINGS[sheet_key])
-                            all_mapped_keys.update(key_in_progress)
-                        else:
-                            df, mapped_keys = apply_mapping_and_merge(df, mapping_df, FIELD_MAPPINGS[sheet_key])
-                            all_mapped_keys.update(mapped_keys)
-
-        
-                    if "date_format" in config:
-                        df = self._process_date_column(df, config["columns"], config["date_format"])
-
-                    pivoted = self._create_pivot(df, config)
-                    pivoted.to_excel(writer, sheet_name=sheet_name, index=False)
-                    adjust_column_width(writer, sheet_name, pivoted)
+                    all_mapped_keys.update(result["mapped_keys"])
+
+                    # 按月份分桶的透视结果为 MonthBlocks，写出时才展开为月份列
+                    pivoted = result["pivoted"]
+                    is_blocks = isinstance(pivoted, MonthBlocks)
+                    if dictionary is not None:
+                        dimensions = key_dimensions(filename, run_config)
+                        pivoted = (
+                            pivoted.with_keys(dictionary.encode_columns(pivoted.keys, dimensions)) if is_blocks
+                            else dictionary.encode_columns(pivoted, dimensions)
+                        )
+                    writer.add_sheet(sheet_name, pivoted)
+
+                    if sheet_key in FIELD_MAPPINGS:
+                        sheet_row_keys[sheet_name] = build_key(pivoted.keys if is_blocks else pivoted, FIELD_MAPPINGS[sheet_key])
 
                     if sheet_key == "unfulfilled_orders":
-                        df_unfulfilled = df
+                        df_unfulfilled = result["df"]
+                        if dictionary is not None:
+                            df_unfulfilled = dictionary.encode_columns(df_unfulfilled, key_dimensions(filename, run_config))
                         pivot_unfulfilled = pivoted
                     elif sheet_key == "finished_inventory":
-                        df_finished = pivoted
+                        df_finished = add_key_column(pivoted, FIELD_MAPPINGS[sheet_key])
                     elif sheet_key == "finished_products":
-                        product_in_progress = pivoted
+                        product_in_progress = add_key_column(pivoted.to_frame() if is_blocks else pivoted, FIELD_MAPPINGS[sheet_key])
 
                 except Exception as e:
-                    st.error(f"❌ 文件 `{filename}` 处理失败: {e}")
+                    log.error(f"❌ 文件 `{filename}` 处理失败: {e}")
 
             if df_unfulfilled.empty:
-                st.error("❌ 缺少未交订单数据，无法构建汇总")
+                log.error("❌ 缺少未交订单数据，无法构建汇总")
                 return
 
-            summary_preview = df_unfulfilled[["晶圆品名", "规格", "品名"]].drop_duplicates().reset_index(drop=True)
+            # 汇总主键只建一次，各来源按主键对齐后追加列（每个主键一行，不会因来源重复而膨胀）
+            assembler = SummaryAssembler(df_unfulfilled[KEY_COLS])
 
             try:
                 if "safety" in additional_sheets:
-                    summary_preview, unmatched_safety = merge_safety_inventory(summary_preview, additional_sheets["safety"])
-                    st.success("✅ 已合并安全库存")
+                    safety_df = add_key_column(additional_sheets["safety"], FIELD_MAPPINGS["safety"])
+                    sheet_row_keys["赛卓-安全库存"] = safety_df[KEY_COLUMN]
+                    with metrics.measure("合并安全库存", "赛卓-安全库存", len(safety_df)):
+                        merge_safety_inventory(assembler, safety_df)
+                    log.stage("合并安全库存", "✅ 已合并安全库存")
 
-                summary_preview, unmatched_unfulfilled = append_unfulfilled_summary_columns(summary_preview, pivot_unfulfilled)
-                st.success("✅ 已合并未交订单")
+                with metrics.measure("合并未交订单", "赛卓-未交订单", len(pivot_unfulfilled)):
+                    append_unfulfilled_summary_columns(assembler, pivot_unfulfilled)
+                log.stage("合并未交订单", "✅ 已合并未交订单")
 
                 if "forecast" in additional_sheets:
                     forecast_df = additional_sheets["forecast"]
                     forecast_df.columns = forecast_df.iloc[0]
-                    forecast_df = forecast_df[1:].reset_index(drop=True)
-                    summary_preview, unmatched_forecast = append_forecast_to_summary(summary_preview, forecast_df)
-                    st.success("✅ 已合并预测数据")
+                    forecast_df = add_key_column(forecast_df[1:].reset_index(drop=True), FIELD_MAPPINGS["forecast"])
+                    sheet_row_keys["赛卓-预测"] = forecast_df[KEY_COLUMN]
+                    with metrics.measure("合并预测数据", "赛卓-预测", len(forecast_df)):
+                        append_forecast_to_summary(assembler, forecast_df, log)
+                    log.stage("合并预测数据", "✅ 已合并预测数据")
 
                 if not df_finished.empty:
-                    if not mapping_df.empty:
-                        df_finished, mapped_keys = apply_mapping_and_merge(df_finished, mapping_df, FIELD_MAPPINGS["finished_inventory"])
-                        all_mapped_keys.update(mapped_keys)
-                    summary_preview, unmatched_finished = merge_finished_inventory(summary_preview, df_finished)
-                    st.success("✅ 已合并成品库存")
+                    with metrics.measure("合并成品库存", "赛卓-成品库存", len(df_finished)):
+                        if mapping_index is not None:
+                            df_finished, mapped_keys = mapping_index.apply(df_finished, FIELD_MAPPINGS["finished_inventory"])
+                            all_mapped_keys.update(mapped_keys)
+                        merge_finished_inventory(assembler, df_finished, log)
+                    log.stage("合并成品库存", "✅ 已合并成品库存")
 
                 if not product_in_progress.empty:
-                    if not mapping_df.empty:
-                        product_in_progress, mapped_keys = apply_mapping_and_merge(product_in_progress, mapping_df, FIELD_MAPPINGS["finished_products"])
-                        all_mapped_keys.update(mapped_keys)
-                    summary_preview, unmatched_in_progress = append_product_in_progress(summary_preview, product_in_progress, mapping_df)
-                    st.success("✅ 已合并成品在制")
+                    with metrics.measure("合并成品在制", "赛卓-成品在制", len(product_in_progress)):
+                        if mapping_index is not None:
+                            product_in_progress, mapped_keys = mapping_index.apply(product_in_progress, FIELD_MAPPINGS["finished_products"])
+                            all_mapped_keys.update(mapped_keys)
+                        append_product_in_progress(assembler, product_in_progress, mapping_df)
+                    log.stage("合并成品在制", "✅ 已合并成品在制")
 
-            except Exception as e:
-                st.error(f"❌ 汇总数据合并失败: {e}")
-                return
+                with metrics.measure("构建汇总", "汇总", len(assembler.keys)) as info:
+                    summary_preview = assembler.build()
+                    info["rows_out"] = len(summary_preview)
 
-            summary_preview = summary_preview.drop_duplicates(subset=["晶圆品名", "规格", "品名"]).reset_index(drop=True)
-            summary_preview = merge_duplicate_product_names(summary_preview)
-            summary_preview.to_excel(writer, sheet_name="汇总", index=False)
-            adjust_column_width(writer, "汇总", summary_preview)
-            ws = writer.sheets["汇总"]
-
-            header_row = list(summary_preview.columns)
-            unfulfilled_cols = [col for col in header_row if "未交订单数量" in col or col in ("总未交订单", "历史未交订单数量")]
-            forecast_cols = [col for col in header_row if "预测" in col]
-            finished_cols = [col for col in header_row if col in ("数量_HOLD仓", "数量_成品仓", "数量_半成品仓")]
-
-            merge_header_for_summary(
-                ws, summary_preview,
-                {
-                    "安全库存": (" InvWaf", " InvPart"),
-                    "未交订单": (unfulfilled_cols[0], unfulfilled_cols[-1]),
-                    "预测": (forecast_cols[0], forecast_cols[-1]) if forecast_cols else ("", ""),
-                    "成品库存": (finished_cols[0], finished_cols[-1]) if finished_cols else ("", ""),
-                    "成品在制": ("成品在制", "半成品在制")
-                }
-            )
+                summary_total, pivot_total = unfulfilled_totals(summary_preview, pivot_unfulfilled)
+                if not math.isclose(summary_total, pivot_total, rel_tol=1e-9, abs_tol=1e-6):
+                    log.error(f"❌ 汇总的总未交订单合计 {summary_total:,.0f} 与未交订单透视合计 {pivot_total:,.0f} 不一致")
 
+                # 各来源主键与汇总主键对账（反连接），得到需标红的未匹配主键
+                reconciler = KeyReconciler(assembler.keys)
+                if "safety" in additional_sheets:
+                    reconciler.add_source("赛卓-安全库存", safety_df[KEY_COLUMN])
+                reconciler.add_source("赛卓-未交订单", sheet_row_keys["赛卓-未交订单"])
+                if "forecast" in additional_sheets:
+                    reconciler.add_source("赛卓-预测", forecast_df[KEY_COLUMN])
+                if not df_finished.empty:
+                    reconciler.add_source("赛卓-成品库存", ensure_key_column(df_finished, FIELD_MAPPINGS["finished_inventory"])[KEY_COLUMN])
+                if not product_in_progress.empty:
+                    reconciler.add_source("赛卓-成品在制", pd.concat([
+                        ensure_key_column(product_in_progress, FIELD_MAPPINGS["finished_products"])[KEY_COLUMN],
+                        semi_finished_keys(mapping_df)
+                    ]))
+
+            except Exception as e:
+                log.error(f"❌ 汇总数据合并失败: {e}")
+                return
 
+            sheet_row_keys["汇总"] = self._add_summary_sheet(writer, "汇总", summary_preview)
+
+            # 多截止月份对比：同一份未交订单月份数组按各截止月份切分，汇总的其余列块共用
+            sweep_months = list(run_config.sweep_months)
+            if sweep_months and not isinstance(pivot_unfulfilled, MonthBlocks):
+                log.warning("⚠️ 未交订单数量无法按月份数组透视，已跳过多截止月份对比")
+            elif sweep_months and run_config.sweep_layout == "long":
+                with metrics.measure("多截止月份对比", CUTOFF_COMPARISON_SHEET, len(pivot_unfulfilled)) as info:
+                    comparison = cutoff_comparison(pivot_unfulfilled, sweep_months)
+                    info["rows_out"] = len(comparison)
+                writer.add_sheet(CUTOFF_COMPARISON_SHEET, comparison)
+                sheet_row_keys[CUTOFF_COMPARISON_SHEET] = build_key(comparison)
+            elif sweep_months:
+                unfulfilled_keys, _ = unfulfilled_summary_columns(pivot_unfulfilled)
+                rows = assembler.summary_rows(unfulfilled_keys)
+                for cutoff, folded in zip(sweep_months, pivot_unfulfilled.sweep(sweep_months)):
+                    sheet_name = f"汇总_{cutoff}"
+                    with metrics.measure("多截止月份对比", sheet_name, len(pivot_unfulfilled)) as info:
+                        block = assembler.sum_rows(rows, unfulfilled_summary_columns(folded)[1])
+                        summary = assembler.build(replace={UNFULFILLED_BLOCK: block})
+                        info["rows_out"] = len(summary)
+                    sheet_row_keys[sheet_name] = self._add_summary_sheet(writer, sheet_name, summary)
+                log.stage("多截止月份对比", f"✅ 已生成 {len(sweep_months)} 个截止月份的汇总")
+
+            # 预测的第 1 行数据是原始表头、新旧料号的第 1 行数据是说明行，均不写出
             for key, df in additional_sheets.items():
                 if key == "mapping":
-                    df.to_excel(writer, sheet_name="赛卓-新旧料号", index=False)
-                    adjust_column_width(writer, "赛卓-新旧料号", df)
+                    writer.add_sheet("赛卓-新旧料号", df, skip_rows=1)
                 else:
                     sheet_name = REVERSE_MAPPING.get(key, key)
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    adjust_column_width(writer, sheet_name, df)
+                    writer.add_sheet(sheet_name, df, skip_rows=1 if key == "forecast" else 0)
+
+            if run_config.reconciliation_sheet:
+                reconciler.write_sheet(writer)
 
             try:
-                mark_unmatched_keys_on_sheet(writer.sheets["赛卓-安全库存"], unmatched_safety, wafer_col=1, spec_col=3, name_col=5)
-                mark_unmatched_keys_on_sheet(writer.sheets["赛卓-未交订单"], unmatched_unfulfilled, wafer_col=1, spec_col=2, name_col=3)
-                mark_unmatched_keys_on_sheet(writer.sheets["赛卓-预测"], unmatched_forecast, wafer_col=3, spec_col=1, name_col=2)
-                writer.sheets["赛卓-预测"].delete_rows(2)
-                mark_unmatched_keys_on_sheet(writer.sheets["赛卓-成品库存"], unmatched_finished, wafer_col=1, spec_col=2, name_col=3)
-                mark_unmatched_keys_on_sheet(writer.sheets["赛卓-成品在制"], unmatched_in_progress, wafer_col=3, spec_col=4, name_col=5)
-                writer.sheets["赛卓-新旧料号"].delete_rows(2)
-            
-                mark_keys_on_sheet(writer.sheets["汇总"], all_mapped_keys, (2, 3, 1))
-                mark_keys_on_sheet(writer.sheets["赛卓-安全库存"], all_mapped_keys, (3, 5, 1))
-                mark_keys_on_sheet(writer.sheets["赛卓-未交订单"], all_mapped_keys, (2, 3, 1))
-                mark_keys_on_sheet(writer.sheets["赛卓-预测"], all_mapped_keys, (1, 2, 3))
-                mark_keys_on_sheet(writer.sheets["赛卓-成品库存"], all_mapped_keys, (2, 3, 1))
-                mark_keys_on_sheet(writer.sheets["赛卓-成品在制"], all_mapped_keys, (4, 5, 3))
-                
-                st.success("✅ 已完成未匹配项标记")
+                # 先标红未匹配行，再标黄新旧料号替换行（黄色覆盖红色）；各 sheet 的标色向量在写出时计算
+                with metrics.measure("标记未匹配项"):
+                    for sheet_name in ("赛卓-安全库存", "赛卓-未交订单", "赛卓-预测", "赛卓-成品库存", "赛卓-成品在制"):
+                        writer.mark_rows(sheet_name, sheet_row_keys.get(sheet_name), reconciler.unmatched(sheet_name), UNMATCHED_FILL)
+                    summary_sheets = [name for name in sheet_row_keys if name == "汇总" or name.startswith("汇总_")]
+                    for sheet_name in summary_sheets + ["赛卓-安全库存", "赛卓-未交订单", "赛卓-预测", "赛卓-成品库存", "赛卓-成品在制", CUTOFF_COMPARISON_SHEET]:
+                        writer.mark_rows(sheet_name, sheet_row_keys.get(sheet_name), all_mapped_keys, MAPPED_FILL)
+
+                log.stage("标记未匹配项", "✅ 已完成未匹配项标记")
             except Exception as e:
-                st.warning(f"⚠️ 未匹配标记失败：{e}")
-
-            for name, ws in writer.sheets.items():
-                col_letter = get_column_letter(ws.max_column)
-                if name == "汇总":
-                    ws.auto_filter.ref = f"A2:{col_letter}2"
-                else:
-                    ws.auto_filter.ref = f"A1:{col_letter}1"
-
-            output_buffer.seek(0)
+                log.warning(f"⚠️ 未匹配标记失败：{e}")
+
+        # 退出 writer 时写出 Excel
+        log.stage("写出 Excel")
+
+    def _add_summary_sheet(self, writer, sheet_name, summary_preview):
+        """
+        合并重复品名后登记一个汇总 sheet（顶部为合并标题行，表头在第 2 行），返回各数据行的规范化主键。
+        """
+        with self.metrics.measure("合并重复品名", sheet_name, len(summary_preview)) as info:
+            summary_preview = merge_duplicate_product_names(summary_preview.drop(columns=KEY_COLUMN))
+            info["rows_out"] = len(summary_preview)
+
+        header_row = list(summary_preview.columns)
+        unfulfilled_cols = [col for col in header_row if "未交订单数量" in col or col in ("总未交订单", "历史未交订单数量")]
+        forecast_cols = [col for col in header_row if "预测" in col]
+        finished_cols = [col for col in header_row if col in ("数量_HOLD仓", "数量_成品仓", "数量_半成品仓")]
+
+        writer.add_sheet(
+            sheet_name, summary_preview,
+            header_ranges={
+                "安全库存": (" InvWaf", " InvPart"),
+                "未交订单": (unfulfilled_cols[0], unfulfilled_cols[-1]),
+                "预测": (forecast_cols[0], forecast_cols[-1]) if forecast_cols else ("", ""),
+                "成品库存": (finished_cols[0], finished_cols[-1]) if finished_cols else ("", ""),
+                "成品在制": ("成品在制", "半成品在制")
+            }
+        )
+        return build_key(summary_preview)
 
     def _process_date_column(self, df, date_col, date_format):
-        if pd.api.types.is_numeric_dtype(df[date_col]):
-            df[date_col] = df[date_col].apply(self._excel_serial_to_date)
-        else:
-            df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
-
-        new_col = f"{date_col}_年月"
-        df[new_col] = df[date_col].dt.strftime(date_format)
-        df[new_col] = df[new_col].fillna("未知日期")
+        df[date_col] = to_datetime_column(df[date_col])
+        df[f"{date_col}_年月"] = month_bucket(df[date_col], date_format)
         return df
 
-    def _excel_serial_to_date(self, serial):
-        try:
-            return datetime(1899, 12, 30) + timedelta(days=float(serial))
-        except:
-            return pd.NaT
-
-    def _create_pivot(self, df, config):
+    def _create_pivot(self, df, config, selected_month=None, log=None):
+        """
+        按配置透视。按月份分桶且数值列可求和时返回 MonthBlocks（历史合并在月份数组上完成），
+        否则返回展开后的 DataFrame。
+        """
+        log = log or StreamlitLog()
         config = config.copy()
+        history = selected_month and config.get("values") and "未交订单数量" in config.get("values")
         if "date_format" in config:
             config["columns"] = f"{config['columns']}_年月"
-    
-        pivoted = pd.pivot_table(
-            df,
-            index=config["index"],
-            columns=config["columns"],
-            values=config["values"],
-            aggfunc=config["aggfunc"],
-            fill_value=0
-        )
-
-        pivoted.columns = [f"{col[0]}_{col[1]}" if isinstance(col, tuple) else str(col) for col in pivoted.columns]
-
-        if pd.Series(pivoted.columns).duplicated().any():
-            from pandas.io.parsers import ParserBase
-            original_cols = pivoted.columns
-            deduped_cols = ParserBase({'names': original_cols})._maybe_dedup_names(original_cols)
-            pivoted.columns = deduped_cols
-
-        pivoted = pivoted.reset_index()
-
-        if CONFIG.get("selected_month") and config.get("values") and "未交订单数量" in config.get("values"):
-            st.info(f"📅 合并历史数据至：{CONFIG['selected_month']}")
-            pivoted = process_history_columns(pivoted, config, CONFIG["selected_month"])
+            if config.get("aggfunc", "sum") == "sum" and all(is_summable(df[col]) for col in config["values"]):
+                pivoted = MonthBlocks.pivot(df, config["index"], config["columns"], config["values"])
+                if history:
+                    log.info(f"📅 合并历史数据至：{selected_month}")
+                    pivoted = pivoted.fold_history(selected_month)
+                return pivoted
+
+        pivoted = pivot_from_config(df, config)
+
+        if history:
+            log.info(f"📅 合并历史数据至：{selected_month}")
+            pivoted = process_history_columns(pivoted, config, selected_month)
         return pivoted
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from key_utils import KEY_COLUMN
+
+RECONCILIATION_SHEET = "对账"
+
+
+def anti_join_keys(source_keys, target_keys):
+    """
+    用带 indicator 的 left merge 判断 source_keys 中每个主键是否出现在 target_keys 中。
+
+    参数:
+    - source_keys: 来源表的规范化组合主键（可重复）
+    - target_keys: 汇总表的规范化组合主键（可重复）
+
+    返回:
+    - matched: 已匹配主键数组（去重，保持首次出现顺序）
+    - unmatched: 未匹配主键数组（去重，保持首次出现顺序）
+    """
+    source = pd.DataFrame({KEY_COLUMN: pd.unique(np.asarray(source_keys, dtype=object))})
+    target = pd.DataFrame({KEY_COLUMN: pd.unique(np.asarray(target_keys, dtype=object))})
+
+    joined = source.merge(target, on=KEY_COLUMN, how="left", indicator=True)
+    found = (joined["_merge"] == "both").to_numpy()
+    keys = joined[KEY_COLUMN].to_numpy()
+    return keys[found], keys[~found]
+
+
+class KeyReconciler:
+    """
+    汇总主键对账：对每个来源表做一次反连接，记录已匹配/未匹配主键，并可输出“对账” sheet。
+    """
+
+    def __init__(self, summary_keys):
+        self.summary_keys = pd.unique(np.asarray(summary_keys, dtype=object))
+        self.results = {}
+
+    def add_source(self, source, keys):
+        """
+        对账一个来源（source 一般为该来源写入的 sheet 名），返回其未匹配主键数组。
+        """
+        keys = np.asarray(keys, dtype=object)
+        matched, unmatched = anti_join_keys(keys, self.summary_keys)
+        self.results[source] = {
+            "rows": len(keys),
+            "matched": matched,
+            "unmatched": unmatched
+        }
+        return unmatched
+
+    def unmatched(self, source):
+        """
+        返回某来源的未匹配主键数组；未对账的来源返回空数组。
+        """
+        result = self.results.get(source)
+        return result["unmatched"] if result else np.array([], dtype=object)
+
+    def report(self):
+        """
+        各来源的匹配统计表。
+        """
+        rows = []
+        for source, result in self.results.items():
+            matched = len(result["matched"])
+            unmatched = len(result["unmatched"])
+            total = matched + unmatched
+            rows.append({
+                "来源": source,
+                "行数": result["rows"],
+                "主键数": total,
+                "已匹配主键数": matched,
+                "未匹配主键数": unmatched,
+                "匹配率": round(matched / total, 4) if total else 1.0
+            })
+        return pd.DataFrame(rows, columns=["来源", "行数", "主键数", "已匹配主键数", "未匹配主键数", "匹配率"])
+
+    def write_sheet(self, writer, sheet_name=RECONCILIATION_SHEET):
+        """
+        将对账统计登记为 writer（report_writer.StreamingReportWriter）的 sheet_name 工作表。
+        """
+        writer.add_sheet(sheet_name, self.report())
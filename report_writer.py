@@ -0,0 +1,254 @@
+import copy
+import datetime
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.styles import Alignment, Border, Font, Side
+from openpyxl.utils import get_column_letter
+from excel_utils import column_widths, header_merge_ranges
+from instrumentation import StageMetrics
+from month_blocks import MonthBlocks
+
+# 与 pandas 默认表头样式一致
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=Side(style="thin"), right=Side(style="thin"), top=Side(style="thin"), bottom=Side(style="thin"))
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
+TITLE_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+
+DATETIME_FORMAT = "YYYY-MM-DD HH:MM:SS"
+DATE_FORMAT = "YYYY-MM-DD"
+
+# 每次转换为 Python 对象的行数，控制写出时的内存占用
+CHUNK_ROWS = 5000
+
+# 行标色的写出方式：
+# - "conditional": 每种颜色一条条件格式，范围为连续标色行区间（不逐格写样式，文件最小）
+# - "cell": 标色行的每个单元格写入样式（排序后颜色随行移动）
+HIGHLIGHT_STYLES = ("conditional", "cell")
+
+
+class SheetPlan:
+    """
+    单个 sheet 的写出计划：数据、顶部合并标题、跳过的辅助行与按主键决定的行填充。
+    """
+
+    def __init__(self, name, df, skip_rows=0, header_ranges=None):
+        self.name = name
+        self.df = df
+        self.skip_rows = skip_rows
+        self.merges = header_merge_ranges(df.columns, header_ranges) if header_ranges else []
+        self.marks = []
+
+    @property
+    def row_count(self):
+        return max(len(self.df) - self.skip_rows, 0)
+
+    def row_highlights(self):
+        """
+        按登记顺序合并各次标色（后登记的覆盖先登记的），得到每个数据行的标色向量。
+
+        返回:
+        - codes: 每个数据行的填充编号（-1 表示不标色）
+        - fills: 编号对应的 PatternFill 列表
+        """
+        codes = np.full(self.row_count, -1, dtype=np.int16)
+        fills = []
+        for row_keys, target_keys, fill in self.marks:
+            if fill not in fills:
+                fills.append(fill)
+            hits = pd.Series(row_keys, copy=False).isin(target_keys).to_numpy()
+            codes[hits] = fills.index(fill)
+        return codes, fills
+
+
+class StreamingReportWriter:
+    """
+    流式报表写出：各 sheet 先登记写出计划（合并标题、辅助行、列宽、筛选、行填充都在此时确定），
+    退出上下文时按登记顺序以 openpyxl write-only 模式逐行写出，不在内存中保留整表的单元格对象，
+    写出后也不再插入/删除行或回填样式。
+
+    标色先按主键算出每个数据行的标色向量，再按 highlight_style（见 HIGHLIGHT_STYLES）写出，
+    不逐格回填样式。
+
+    用法:
+        with StreamingReportWriter(output_buffer) as writer:
+            writer.add_sheet("汇总", summary_df, header_ranges={...})
+            writer.mark_rows("汇总", row_keys, mapped_keys, MAPPED_FILL)
+    """
+
+    def __init__(self, output_buffer, highlight_style="conditional", metrics=None):
+        if highlight_style not in HIGHLIGHT_STYLES:
+            raise ValueError(f"不支持的标色方式：{highlight_style}（可选 {'/'.join(HIGHLIGHT_STYLES)}）")
+        self.output_buffer = output_buffer
+        self.highlight_style = highlight_style
+        # 写出时按 sheet 记录“标色”“写出 sheet”，最后记录“保存工作簿”
+        self.metrics = metrics or StageMetrics()
+        self.sheets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # 与 pd.ExcelWriter 一致：中途出错也保存已登记的 sheet
+        self.save()
+        return False
+
+    def add_sheet(self, sheet_name, df, skip_rows=0, header_ranges=None):
+        """
+        登记一个 sheet。
+
+        参数:
+        - sheet_name: 工作表名称
+        - df: 写入的数据（表头为列名，不写索引）；MonthBlocks 在写出时展开
+        - skip_rows: 跳过 df 开头的辅助行（不写出，仍参与列宽计算）
+        - header_ranges: 顶部合并标题，格式见 excel_utils.header_merge_ranges；提供时表头下移到第 2 行
+        """
+        self.sheets[sheet_name] = SheetPlan(sheet_name, df, skip_rows, header_ranges)
+
+    def mark_rows(self, sheet_name, row_keys, target_keys, fill):
+        """
+        将 sheet 中主键属于 target_keys 的数据行整行填充 fill；未登记的 sheet 或缺少主键时忽略。
+
+        参数:
+        - row_keys: 与写出的数据行（跳过辅助行后）一一对应的规范化主键
+        - target_keys: 需标色的规范化主键（数组或集合）
+        - fill: openpyxl PatternFill
+        """
+        plan = self.sheets.get(sheet_name)
+        if plan is None or row_keys is None:
+            return
+        if len(row_keys) != plan.row_count:
+            raise ValueError(f"`{sheet_name}` 主键行数 {len(row_keys)} 与数据行数 {plan.row_count} 不一致")
+        plan.marks.append((row_keys, pd.Index(list(target_keys), dtype=object), fill))
+
+    def save(self):
+        wb = Workbook(write_only=True)
+        for plan in self.sheets.values():
+            highlights = None
+            if plan.marks:
+                with self.metrics.measure("标色", plan.name, plan.row_count):
+                    highlights = plan.row_highlights()
+            with self.metrics.measure("写出 sheet", plan.name, plan.row_count):
+                _write_sheet(wb.create_sheet(plan.name), plan, self.highlight_style, highlights)
+        with self.metrics.measure("保存工作簿"):
+            wb.save(self.output_buffer)
+        if hasattr(self.output_buffer, "seek"):
+            self.output_buffer.seek(0)
+
+
+def _write_sheet(ws, plan, highlight_style="conditional", highlights=None):
+    # 月份分桶的透视结果在写出时才展开为“度量_月份”列
+    df = plan.df.to_frame() if isinstance(plan.df, MonthBlocks) else plan.df
+    n_cols = len(df.columns)
+
+    # write-only 模式下列宽、合并、筛选都需在写出前设置
+    for idx, width in enumerate(column_widths(df), 1):
+        ws.column_dimensions[get_column_letter(idx)].width = width
+
+    header_row = 1
+    if plan.merges:
+        title = [None] * n_cols
+        for label, start_idx, end_idx in plan.merges:
+            ws.merged_cells.add(f"{get_column_letter(start_idx)}1:{get_column_letter(end_idx)}1")
+            cell = WriteOnlyCell(ws, label)
+            cell.alignment = TITLE_ALIGNMENT
+            cell.font = HEADER_FONT
+            title[start_idx - 1] = cell
+        ws.append(title)
+        header_row = 2
+
+    if n_cols:
+        ws.auto_filter.ref = f"A{header_row}:{get_column_letter(n_cols)}{header_row}"
+
+    header = []
+    for col in df.columns:
+        cell = _dated_cell(ws, None if _is_missing(col) else col)
+        if not isinstance(cell, Cell):
+            cell = WriteOnlyCell(ws, cell)
+        cell.font = HEADER_FONT
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+        header.append(cell)
+    ws.append(header)
+
+    codes, fills = plan.row_highlights() if highlights is None else highlights
+    if highlight_style == "conditional":
+        for code, fill in enumerate(fills):
+            ranges = _row_ranges(codes == code, header_row + 1, get_column_letter(n_cols))
+            if ranges:
+                ws.conditional_formatting.add(ranges, FormulaRule(formula=["TRUE"], fill=fill))
+        codes = np.full(len(codes), -1, dtype=np.int16)
+
+    # 每种填充只解析一次样式，标色行的单元格直接复用
+    fill_styles = [_fill_style(ws, fill) for fill in fills]
+    for start in range(plan.skip_rows, len(df), CHUNK_ROWS):
+        chunk = df.iloc[start:start + CHUNK_ROWS]
+        columns = [_column_values(ws, chunk.iloc[:, position]) for position in range(n_cols)]
+        for offset, row in enumerate(zip(*columns), start - plan.skip_rows):
+            code = codes[offset]
+            if code >= 0:
+                row = [_filled_cell(ws, value, fills[code], fill_styles[code]) for value in row]
+            ws.append(row)
+
+
+def _row_ranges(hits, first_row, last_col):
+    """
+    将逐行命中向量压缩为连续行区间，返回 "A3:K9 A12:K12" 形式的多区域引用（无命中返回空串）。
+    hits[i] 对应工作表第 first_row + i 行。
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], hits.astype(np.int8), [0]))))
+    return " ".join(
+        f"A{first_row + start}:{last_col}{first_row + end - 1}"
+        for start, end in zip(edges[::2], edges[1::2])
+    )
+
+
+def _fill_style(ws, fill):
+    cell = WriteOnlyCell(ws)
+    cell.fill = fill
+    return cell._style
+
+
+def _is_missing(value):
+    try:
+        return bool(pd.isna(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def _column_values(ws, series):
+    """
+    将一列转换为可直接写入的值列表：空值为 None，无穷大写为字符串，日期类值带日期格式。
+    """
+    if pd.api.types.is_float_dtype(series) and np.isinf(series.to_numpy(dtype=float, na_value=np.nan)).any():
+        series = series.astype(object).replace({np.inf: "inf", -np.inf: "-inf"})
+
+    values = series.astype(object).where(series.notna(), None).tolist()
+
+    if pd.api.types.is_datetime64_any_dtype(series) or series.dtype == object:
+        values = [_dated_cell(ws, value) for value in values]
+    return values
+
+
+def _dated_cell(ws, value):
+    if isinstance(value, datetime.datetime):
+        cell = WriteOnlyCell(ws, value)
+        cell.number_format = DATETIME_FORMAT
+        return cell
+    if isinstance(value, datetime.date):
+        cell = WriteOnlyCell(ws, value)
+        cell.number_format = DATE_FORMAT
+        return cell
+    return value
+
+
+def _filled_cell(ws, value, fill, style):
+    if isinstance(value, Cell):
+        # 已带数字格式的日期单元格单独合并填充
+        value.fill = fill
+        return value
+    cell = WriteOnlyCell(ws, value)
+    cell._style = copy.copy(style)
+    return cell
@@ -0,0 +1,65 @@
+import copy
+from dataclasses import dataclass, field, replace
+from config import CONFIG
+
+
+@dataclass(frozen=True)
+class RunConfig:
+    """
+    单次生成报告的配置（截止月份、透视配置、各选项），创建后不可修改。
+
+    每个会话 / 每次运行各自持有一份，由 PivotProcessor 及其子进程显式传递，
+    不再写入模块级 CONFIG，多个用户同时生成报告互不影响。CONFIG 只作为默认值。
+    """
+
+    # 历史数据截止月份（如 "2025-03"），None 表示不合并历史
+    selected_month: str = None
+    # 多截止月份对比的截止月份（为空表示不对比）及写出方式，见 CONFIG["sweep_months"]
+    sweep_months: tuple = ()
+    sweep_layout: str = "sheets"
+    reconciliation_sheet: bool = False
+    drop_zero_rows: bool = False
+    low_memory: bool = False
+    mapping_duplicate_policy: str = "first"
+    resolve_mapping_chains: bool = True
+    highlight_style: str = "conditional"
+    ingest_workers: int = None
+    profile_memory: bool = False
+    profile_run: bool = False
+    # 各源文件的透视配置（创建时深拷贝，只通过 pivot_config_for 取副本）
+    pivot_config: dict = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_config(cls, pivot_overrides=None, **options):
+        """
+        以 CONFIG 中的同名项为默认值创建运行配置。
+
+        参数:
+        - pivot_overrides: dict，文件名 → 要覆盖的透视配置项（如 {"unfulfilled_orders.xlsx": {"date_format": "%Y-%m"}}）
+        - options: 其余字段的取值（如 selected_month="2025-03"）
+        """
+        defaults = {
+            name: CONFIG[name]
+            for name in cls.__dataclass_fields__
+            if name in CONFIG and name not in ("selected_month", "pivot_config")
+        }
+        pivot_config = copy.deepcopy(CONFIG["pivot_config"])
+        for filename, overrides in (pivot_overrides or {}).items():
+            pivot_config[filename] = {**pivot_config.get(filename, {}), **copy.deepcopy(overrides)}
+        return cls(**{**defaults, **options, "pivot_config": pivot_config})
+
+    def __post_init__(self):
+        object.__setattr__(self, "sweep_months", tuple(self.sweep_months or ()))
+
+    def pivot_config_for(self, filename):
+        """
+        某源文件的透视配置副本（未配置的文件返回 None），修改副本不影响本配置。
+        """
+        config = self.pivot_config.get(filename)
+        return copy.deepcopy(config) if config else None
+
+    def replace(self, **changes):
+        """
+        返回修改了部分字段的新配置（原配置不变）。
+        """
+        return replace(self, **changes)
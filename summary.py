@@ -1,236 +1,300 @@
+import numpy as np
 import pandas as pd
-import re
-import streamlit as st
-from openpyxl.styles import PatternFill
+from config import FIELD_MAPPINGS
+from key_utils import KEY_COLUMN, build_key, ensure_key_column
+from log_utils import StreamlitLog
+from month_blocks import MonthBlocks, history_name
 
+# 汇总中“未交订单”部分对应的度量与列块名
+UNFULFILLED_MEASURE = "未交订单数量"
+UNFULFILLED_BLOCK = "未交订单"
 
-def merge_safety_inventory(summary_df, safety_df):
-    """
-    将安全库存表中 Wafer 和 Part 信息合并到汇总数据中，并返回未匹配的主键列表。
+# 半成品在制写入汇总时使用的新料号主键字段
+SEMI_FINISHED_KEY_FIELDS = {"晶圆品名": "新晶圆品名", "规格": "新规格", "品名": "新品名"}
 
-    参数:
-    - summary_df: 汇总后的未交订单表，包含 '晶圆品名'、'规格'、'品名'
-    - safety_df: 安全库存表，包含 'WaferID', 'OrderInformation', 'ProductionNO.', ' InvWaf', ' InvPart'
 
-    返回:
-    - merged: 合并后的汇总 DataFrame
-    - unmatched_keys: list of (晶圆品名, 规格, 品名) 未匹配主键
+class SummaryAssembler:
+    """
+    汇总表组装器：主键索引只建立一次（未交订单中去重后的主键，顺序为首次出现顺序），
+    各来源按主键归并为每个主键一行，再按位置对齐到主键索引上，作为列块追加；最后一次性拼接。
+
+    - 数量类来源（未交订单、成品库存）同一主键的多行求和，不丢失数量；
+      参考类来源（安全库存、预测）同一主键取第一行
+    - 行数始终等于主键数，不会因来源主键重复而膨胀
+    - 来源中找不到的主键对应空值（与左连接一致）
+    - 追加列块不复制已组装的部分
     """
 
-    # 重命名列统一主键
-    safety_df = safety_df.rename(columns={
-        'WaferID': '晶圆品名',
-        'OrderInformation': '规格',
-        'ProductionNO.': '品名'
-    }).copy()
-
-    key_cols = ['晶圆品名', '规格', '品名']
-
-    # 所有主键（包括缺失值的行，缺失值视为空字符串）
-    safety_df['主键'] = safety_df.apply(
-        lambda row: tuple(str(row[col]).strip() if pd.notnull(row[col]) else '' for col in key_cols),
-        axis=1
-    )
-    all_keys = set(safety_df['主键'])
-
-    # 合并到 summary
-    merged = summary_df.merge(
-        safety_df[key_cols + [' InvWaf', ' InvPart']],
-        on=key_cols,
-        how='left'
-    )
-
-    # 记录实际被使用到的主键（在合并结果中出现了非空 InvWaf 或 InvPart 的行）
-    used_keys = set(
-        merged[~merged[[' InvWaf', ' InvPart']].isna().all(axis=1)]
-        .apply(lambda row: tuple(str(row[col]).strip() if pd.notnull(row[col]) else '' for col in key_cols), axis=1)
-    )
-
-    # 剩下的就是未被使用的
-    unmatched_keys = list(all_keys - used_keys)
-
-    # st.write("用到的：")
-    # st.write(used_keys)
-
-    return merged, unmatched_keys
+    def __init__(self, key_rows):
+        """
+        参数:
+        - key_rows: 含 '晶圆品名'、'规格'、'品名' 的明细（如替换后的未交订单），按规范化主键去重后作为汇总行
+        """
+        base = ensure_key_column(key_rows)
+        self.base = base.drop_duplicates(subset=KEY_COLUMN).reset_index(drop=True)
+        self.keys = pd.Index(self.base[KEY_COLUMN])
+        self.blocks = []
+        self.names = []
+
+    def positions(self, source_keys):
+        """
+        每个汇总主键在 source_keys 中首次出现的行号（找不到为 -1）。
+        汇总主键与来源主键一起编码一次，再用编码数组定位，不单独建哈希表。
+        """
+        source_keys = pd.Series(source_keys, copy=False).reset_index(drop=True)
+        codes, uniques = pd.factorize(pd.concat([self.base[KEY_COLUMN], source_keys], ignore_index=True))
+        summary_codes, source_codes = codes[:len(self.keys)], codes[len(self.keys):]
+
+        first = np.full(len(uniques), -1, dtype=np.int64)
+        first[source_codes[::-1]] = np.arange(len(source_codes))[::-1]
+        return first[summary_codes]
+
+    @staticmethod
+    def align(rows, columns_df):
+        """
+        按 positions 得到的行号取出来源的若干列（行号为 -1 的汇总行为空值）。
+        """
+        return columns_df.reset_index(drop=True).reindex(rows).set_axis(range(len(rows)))
+
+    def summary_rows(self, source_keys):
+        """
+        每个来源行对应的汇总行号（主键不在汇总中为 -1），编码方式同 positions。
+        """
+        source_keys = pd.Series(source_keys, copy=False).reset_index(drop=True)
+        codes, uniques = pd.factorize(pd.concat([self.base[KEY_COLUMN], source_keys], ignore_index=True))
+        summary_codes, source_codes = codes[:len(self.keys)], codes[len(self.keys):]
+
+        rows = np.full(len(uniques), -1, dtype=np.int64)
+        rows[summary_codes] = np.arange(len(summary_codes))
+        return rows[source_codes]
+
+    def sum_rows(self, rows, columns_df):
+        """
+        按 summary_rows 得到的汇总行号累加来源的数值列（同一主键多行求和），
+        没有来源行的汇总行为空值。
+        """
+        matched = rows >= 0
+        sums = columns_df.reset_index(drop=True)[matched].groupby(rows[matched]).sum(min_count=1)
+        return sums.reindex(range(len(self.keys)))
+
+    def add_block(self, source_keys, columns_df, name=None, how="first"):
+        """
+        将来源的若干列按主键对齐后追加（source_keys 与 columns_df 的行一一对应）。
+
+        参数:
+        - name: 列块名，用于 build 时替换该列块
+        - how: 同一主键有多行时的归并方式："sum"（数量类来源，数值列求和）/ "first"（参考类来源，取第一行）
+        """
+        if how == "sum":
+            block = self.sum_rows(self.summary_rows(source_keys), columns_df)
+        else:
+            block = self.align(self.positions(source_keys), columns_df)
+        self.blocks.append(block)
+        self.names.append(name)
+
+    def add_series(self, name, by_key, fill_value=None):
+        """
+        追加一列：by_key 为以主键为索引（主键唯一）的 Series，找不到的主键填 fill_value。
+        """
+        values = by_key.reset_index(drop=True).reindex(pd.Index(by_key.index).get_indexer(self.keys))
+        if fill_value is not None:
+            values = values.fillna(fill_value)
+        self.blocks.append(values.rename(name).to_frame().set_axis(range(len(self.keys))))
+        self.names.append(name)
+
+    def build(self, replace=None):
+        """
+        返回组装好的汇总表：主键字段、KEY_COLUMN，其后为按追加顺序排列的各列块。
+        replace: dict，列块名 → 已对齐的列块，用于替换同名列块（如各截止月份的未交订单列）。
+        """
+        replace = replace or {}
+        blocks = [replace.get(name, block) for name, block in zip(self.names, self.blocks)]
+        return pd.concat([self.base] + blocks, axis=1)
+
+
+def merge_safety_inventory(assembler, safety_df):
+    """
+    将安全库存表中 Wafer 和 Part 信息合并到汇总数据中。
 
+    参数:
+    - assembler: 汇总表组装器（SummaryAssembler）
+    - safety_df: 安全库存表，包含 'WaferID', 'OrderInformation', 'ProductionNO.', ' InvWaf', ' InvPart'
+    """
+    safety_df = ensure_key_column(safety_df, FIELD_MAPPINGS["safety"])
+    assembler.add_block(safety_df[KEY_COLUMN], safety_df[[' InvWaf', ' InvPart']])
 
 
+def unfulfilled_summary_columns(pivoted):
+    """
+    从未交订单透视结果中提取历史未交订单 + 各未来月份未交订单列，并计算总未交订单。
 
+    参数:
+    - pivoted: 未交订单透视结果（MonthBlocks；数值列无法求和时为展开后的 DataFrame）
 
-def append_unfulfilled_summary_columns(summary_df, pivoted_df):
-    """
-    提取历史未交订单 + 各未来月份未交订单列，计算总未交订单，并将它们添加到汇总 summary_df 的末尾。
-    返回合并后的 summary_df 和未匹配的主键列表。
+    返回:
+    - keys: 与返回各行对应的规范化主键
+    - DataFrame：总未交订单、历史未交订单数量（有历史月份时）、各月份未交订单数量
     """
+    if isinstance(pivoted, MonthBlocks):
+        # 合计与列顺序直接在月份数组上计算
+        columns = {"总未交订单": pivoted.total(UNFULFILLED_MEASURE), **pivoted.measure_columns(UNFULFILLED_MEASURE)}
+        return build_key(pivoted.keys), pd.DataFrame(columns)
+
+    pivoted_df = ensure_key_column(pivoted)
 
     # 匹配所有未交订单列
-    unfulfilled_cols = [col for col in pivoted_df.columns if "未交订单数量" in col]
-    unfulfilled_df = pivoted_df[["晶圆品名", "规格", "品名"] + unfulfilled_cols].copy()
+    unfulfilled_cols = [col for col in pivoted_df.columns if UNFULFILLED_MEASURE in col]
+    unfulfilled_df = pivoted_df[unfulfilled_cols].copy()
 
     # 计算总未交订单
     unfulfilled_df["总未交订单"] = unfulfilled_df[unfulfilled_cols].sum(axis=1)
 
     # 整理列顺序
-    ordered_cols = ["晶圆品名", "规格", "品名", "总未交订单"]
+    ordered_cols = ["总未交订单"]
     if "历史未交订单数量" in pivoted_df.columns:
         ordered_cols.append("历史未交订单数量")
     ordered_cols += [col for col in unfulfilled_cols if col != "历史未交订单数量"]
-    unfulfilled_df = unfulfilled_df[ordered_cols]
 
-    # 查找未匹配主键
-    summary_keys = set(
-        tuple(str(x).strip() for x in row)
-        for row in summary_df[["晶圆品名", "规格", "品名"]].dropna().values
-    )
-    unmatched_keys = []
-    for _, row in unfulfilled_df.iterrows():
-        key = (str(row["晶圆品名"]).strip(), str(row["规格"]).strip(), str(row["品名"]).strip())
-        if key not in summary_keys:
-            unmatched_keys.append(key)
+    return pivoted_df[KEY_COLUMN], unfulfilled_df[ordered_cols]
 
-    # 合并
-    merged = summary_df.merge(unfulfilled_df, on=["晶圆品名", "规格", "品名"], how="left")
 
-    return merged, unmatched_keys
+def append_unfulfilled_summary_columns(assembler, pivoted):
+    """
+    将未交订单各列（见 unfulfilled_summary_columns）添加到汇总的末尾，列块名为 UNFULFILLED_BLOCK。
+    同一主键的多个透视行数量求和。
+    """
+    keys, columns = unfulfilled_summary_columns(pivoted)
+    assembler.add_block(keys, columns, name=UNFULFILLED_BLOCK, how="sum")
+
 
+def unfulfilled_totals(summary_df, pivoted):
+    """
+    汇总中“总未交订单”的合计与未交订单透视结果的数量合计。
+    每个透视行都对应一个汇总主键，两者应相等；不等说明汇总丢失或重复计入了部分数量。
+    """
+    _, columns = unfulfilled_summary_columns(pivoted)
+    return float(summary_df["总未交订单"].sum()), float(columns["总未交订单"].sum())
 
 
-def append_forecast_to_summary(summary_df, forecast_df):
+def cutoff_comparison(pivoted, cutoffs):
     """
-    从预测表中提取与 summary_df 匹配的预测记录，并返回未匹配的主键列表。
+    多截止月份对比（长表）：每个截止月份 × 每个透视行一行，列为 截止月份、index 各列、
+    各度量的历史数量与截止后数量、总未交订单。全部取自同一份月份数组（见 MonthBlocks.sweep）。
 
     参数:
-    - summary_df: 汇总表（含主键）
-    - forecast_df: 原始预测表
+    - pivoted: 未合并历史的未交订单透视结果（MonthBlocks）
+    - cutoffs: 截止月份列表
+    """
+    frames = []
+    for cutoff, folded in zip(cutoffs, pivoted.sweep(cutoffs)):
+        frame = folded.keys.copy()
+        frame.insert(0, "截止月份", cutoff)
+        history = folded.history
+        for measure in folded.blocks:
+            name = history_name(measure)
+            if name is None:
+                continue
+            _, remaining = folded.remaining(measure)
+            frame[name] = history.get(name, 0)
+            frame[f"截止后{measure}"] = remaining.sum(axis=1)
+        frame["总未交订单"] = folded.total(UNFULFILLED_MEASURE)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def append_forecast_to_summary(assembler, forecast_df, log=None):
+    """
+    从预测表中提取与汇总主键匹配的预测记录（同一主键取第一行）。
 
-    返回:
-    - merged: 合并后的 summary_df
-    - unmatched_keys: list of (晶圆品名, 规格, 品名) 未被匹配的主键
+    参数:
+    - assembler: 汇总表组装器
+    - forecast_df: 原始预测表
+    - log: 提示输出（见 log_utils.Log），默认输出到 st
     """
+    log = log or StreamlitLog()
 
     # Debug: 显示原始预测表列
     # st.write("原始预测表列名：", forecast_df.columns.tolist())
 
-    # 重命名主键列
-    forecast_df = forecast_df.rename(columns={
-        "产品型号": "规格",
-        "ProductionNO.": "品名"
-    })
-
-    # 主键列
-    key_cols = ["晶圆品名", "规格", "品名"]
+    forecast_df = ensure_key_column(forecast_df, FIELD_MAPPINGS["forecast"])
 
     # 找出预测月份列（如“5月预测”、“6月预测”...）
     month_cols = [col for col in forecast_df.columns if isinstance(col, str) and "预测" in col]
     # st.write("识别到的预测列：", month_cols)
 
     if not month_cols:
-        st.warning("⚠️ 没有识别到任何预测列，请检查列名是否包含'预测'")
-        return summary_df, []
+        log.warning("⚠️ 没有识别到任何预测列，请检查列名是否包含'预测'")
+        return
 
-    # 去重：每组主键保留第一行
-    forecast_df = forecast_df[key_cols + month_cols].drop_duplicates(subset=key_cols)
-
-    # 查找未匹配的主键
-    summary_keys = set(
-        tuple(str(x).strip() for x in row)
-        for row in summary_df[key_cols].dropna().values
-    )
-    unmatched_keys = []
-    for _, row in forecast_df.iterrows():
-        key = tuple(str(row[col]).strip() for col in key_cols)
-        if key not in summary_keys:
-            unmatched_keys.append(key)
+    assembler.add_block(forecast_df[KEY_COLUMN], forecast_df[month_cols])
 
-    # 合并进 summary
-    merged = summary_df.merge(forecast_df, on=key_cols, how="left")
-    # st.write("合并后的汇总示例：", merged.head(3))
 
-    return merged, unmatched_keys
-
-
-
-def merge_finished_inventory(summary_df, finished_df):
+def merge_finished_inventory(assembler, finished_df, log=None):
     """
-    合并成品库存表进 summary_df，并返回未匹配的主键。
+    合并成品库存表进汇总。
 
     参数:
-    - summary_df: 汇总数据
+    - assembler: 汇总表组装器
     - finished_df: 透视后的成品库存表
-
-    返回:
-    - merged: 合并后的 DataFrame
-    - unmatched_keys: list of (晶圆品名, 规格, 品名) 未匹配的键
+    - log: 提示输出（见 log_utils.Log），默认输出到 st
     """
+    log = log or StreamlitLog()
 
     # 确保列名干净
     finished_df.columns = finished_df.columns.str.strip()
 
-    # 主键列转换
-    finished_df = finished_df.rename(columns={"WAFER品名": "晶圆品名"})
-
-    key_cols = ["晶圆品名", "规格", "品名"]
     value_cols = ["数量_HOLD仓", "数量_成品仓", "数量_半成品仓"]
+    key_source_cols = list(FIELD_MAPPINGS["finished_inventory"].values())
 
-    for col in key_cols + value_cols:
+    for col in key_source_cols + value_cols:
         if col not in finished_df.columns:
-            st.error(f"❌ 缺失列：{col}")
-            return summary_df, []
+            log.error(f"❌ 缺失列：{col}")
+            return
 
-    # 提取未匹配主键
-    summary_keys = set(
-        tuple(str(x).strip() for x in row)
-        for row in summary_df[key_cols].dropna().values
-    )
-
-    unmatched_keys = []
-    for _, row in finished_df.iterrows():
-        key = tuple(str(row[col]).strip() for col in key_cols)
-        if key not in summary_keys:
-            unmatched_keys.append(key)
+    finished_df = ensure_key_column(finished_df, FIELD_MAPPINGS["finished_inventory"])
 
     # st.write("✅ 正在按主键合并以下列：", value_cols)
-    merged = summary_df.merge(finished_df[key_cols + value_cols], on=key_cols, how="left")
+    # 库存数量：同一主键多行（如替换后并入同一新料号）求和
+    assembler.add_block(finished_df[KEY_COLUMN], finished_df[value_cols], how="sum")
 
-    return merged, unmatched_keys
 
 
+def _key_totals(keys, values):
+    """
+    按主键累加每行的数值合计，返回以主键为索引的 Series（主键唯一）。
+    """
+    return values.groupby(keys.to_numpy(), sort=False).sum()
+
 
-def append_product_in_progress(summary_df, product_in_progress_df, mapping_df):
+def _latest_by_key(keys, values):
     """
-    将成品在制与半成品在制信息合并到 summary_df 中，并返回未匹配的主键。
+    同一主键出现多次时以最后一行为准，返回以主键为索引的 Series（主键唯一）。
+    """
+    latest = ~keys.duplicated(keep="last")
+    return pd.Series(values[latest].to_numpy(), index=keys[latest].to_numpy())
+
+
+def append_product_in_progress(assembler, product_in_progress_df, mapping_df):
+    """
+    将成品在制与半成品在制两列追加到汇总中。
+    全部基于主键哈希查找完成，复杂度约为 O(n + m)。
 
     参数：
-    - summary_df: 汇总表（含“晶圆品名”，“规格”，“品名”）
+    - assembler: 汇总表组装器
     - product_in_progress_df: 透视后的“赛卓-成品在制”数据
     - mapping_df: 新旧料号映射表，包含“半成品”列
-
-    返回：
-    - summary_df: 添加了“成品在制”与“半成品在制”的 DataFrame
-    - unmatched_keys: list of (晶圆品名, 规格, 品名) 未被使用的原始行主键
     """
     numeric_cols = product_in_progress_df.select_dtypes(include='number').columns.tolist()
-    summary_df = summary_df.copy()
-    summary_df["成品在制"] = 0
-    summary_df["半成品在制"] = 0
-
-    used_keys = set()
-    unmatched_keys = []
-
-    # 填充成品在制
-    for idx, row in product_in_progress_df.iterrows():
-        key = (str(row["晶圆型号"]).strip(), str(row["产品规格"]).strip(), str(row["产品品名"]).strip())
-        mask = (
-            (summary_df["晶圆品名"] == key[0]) &
-            (summary_df["规格"] == key[1]) &
-            (summary_df["品名"] == key[2])
-        )
-        if mask.any():
-            used_keys.add(key)
-            summary_df.loc[mask, "成品在制"] = row[numeric_cols].sum()
-        else:
-            unmatched_keys.append(key)
+    product_in_progress_df = ensure_key_column(product_in_progress_df, FIELD_MAPPINGS["finished_products"])
+
+    pip_keys = product_in_progress_df[KEY_COLUMN]
+    row_totals = product_in_progress_df[numeric_cols].sum(axis=1) if numeric_cols else pd.Series(0, index=pip_keys.index)
+    summary_keys = assembler.keys
+
+    # 成品在制：同一主键多行时以最后一行为准
+    finished_matched = pip_keys.isin(summary_keys)
+    finished_latest = _latest_by_key(pip_keys[finished_matched], row_totals[finished_matched])
+    assembler.add_series("成品在制", finished_latest, fill_value=0)
 
     # 半成品逻辑
     semi_rows = mapping_df[mapping_df["半成品"].notna() & (mapping_df["半成品"] != "")]
@@ -239,62 +303,34 @@ def append_product_in_progress(summary_df, product_in_progress_df, mapping_df):
         "旧规格", "旧品名", "旧晶圆品名",
         "半成品"
     ]].copy()
-    semi_info_table["未交数据和"] = 0
-
-    # 日志记录每一次匹配尝试
-    check_log = []
-
-    for idx, row in semi_info_table.iterrows():
-        matched = product_in_progress_df[
-            (product_in_progress_df["产品规格"] == row["新规格"]) &
-            (product_in_progress_df["晶圆型号"] == row["新晶圆品名"]) &
-            (product_in_progress_df["产品品名"] == row["半成品"])
-        ]
-        if not matched.empty:
-            value = matched[numeric_cols].sum().sum()
-            source = "新规格/新晶圆匹配"
-        else:
-            matched = product_in_progress_df[
-                (product_in_progress_df["产品规格"] == row["旧规格"]) &
-                (product_in_progress_df["晶圆型号"] == row["旧晶圆品名"]) &
-                (product_in_progress_df["产品品名"] == row["半成品"])
-            ]
-            if not matched.empty:
-                value = matched[numeric_cols].sum().sum()
-                source = "旧规格/旧晶圆回退匹配"
-            else:
-                value = 0
-                source = "未匹配"
-
-        semi_info_table.at[idx, "未交数据和"] = value
-        check_log.append({
-            "半成品": row["半成品"],
-            "新品名": row["新品名"],
-            "新规格": row["新规格"],
-            "新晶圆品名": row["新晶圆品名"],
-            "旧规格": row["旧规格"],
-            "旧晶圆品名": row["旧晶圆品名"],
-            "匹配来源": source,
-            "匹配值": value
-        })
-
-    # 写入 summary_df
-    for idx, row in semi_info_table.iterrows():
-        key = (row["新晶圆品名"], row["新规格"], row["新品名"])
-        mask = (
-            (summary_df["晶圆品名"] == key[0]) &
-            (summary_df["规格"] == key[1]) &
-            (summary_df["品名"] == key[2])
-        )
-        if mask.any():
-            summary_df.loc[mask, "半成品在制"] = row["未交数据和"]
-            used_keys.add(key)
-        else:
-            unmatched_keys.append(key)
+
+    # 在制按主键预先汇总，半成品先用新规格/新晶圆匹配，找不到再回退旧规格/旧晶圆
+    pip_totals = _key_totals(pip_keys, row_totals)
+    new_probe = build_key(semi_info_table, {"晶圆品名": "新晶圆品名", "规格": "新规格", "品名": "半成品"})
+    old_probe = build_key(semi_info_table, {"晶圆品名": "旧晶圆品名", "规格": "旧规格", "品名": "半成品"})
+    new_found = new_probe.isin(pip_totals.index).to_numpy()
+    old_found = old_probe.isin(pip_totals.index).to_numpy()
+
+    semi_info_table["未交数据和"] = np.where(
+        new_found, new_probe.map(pip_totals),
+        np.where(old_found, old_probe.map(pip_totals), 0)
+    )
+
+    # 写入汇总：同一新主键多行时以最后一行为准
+    semi_keys = build_key(semi_info_table, SEMI_FINISHED_KEY_FIELDS)
+    semi_matched = semi_keys.isin(summary_keys)
+
+    semi_latest = _latest_by_key(semi_keys[semi_matched], semi_info_table.loc[semi_matched, "未交数据和"])
+    assembler.add_series("半成品在制", semi_latest, fill_value=0)
 
     # 打印匹配日志
     # st.write("【半成品匹配日志】")
-    # for log in check_log:
-        # st.write(log)
+    # st.write(semi_info_table)
 
-    return summary_df, unmatched_keys
+
+def semi_finished_keys(mapping_df):
+    """
+    返回新旧料号表中带“半成品”的行对应的新料号主键（用于对账“成品在制”来源）。
+    """
+    semi_rows = mapping_df[mapping_df["半成品"].notna() & (mapping_df["半成品"] != "")]
+    return build_key(semi_rows, SEMI_FINISHED_KEY_FIELDS)
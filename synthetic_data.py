@@ -0,0 +1,254 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+# 单个工作表最多的数据行数（Excel 上限 1,048,576 行，含表头）
+MAX_SHEET_ROWS = 1048575
+
+# 五个主表（行数平均分配）
+MAIN_FILES = [
+    "unfulfilled_orders.xlsx", "finished_products.xlsx", "cp_in_progress.xlsx",
+    "finished_inventory.xlsx", "wafer_inventory.xlsx"
+]
+
+# 新旧料号表表头（两个“晶圆品名”列，读入后第二个为“晶圆品名.1”）
+MAPPING_HEADER = ["旧规格", "旧品名", "晶圆品名", "新规格", "新品名", "晶圆品名", "封装厂", "PC", "半成品", "备注"]
+
+# Excel 序列日期的起点
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+
+class KeyPool:
+    """
+    主键池：keys 个不同的 (晶圆品名, 规格, 品名)，晶圆品名和规格在多个主键间共用。
+    取值时按 dirty_rate 混入全角空格 / 引号 / 首尾空格等需规范化的写法。
+    """
+
+    def __init__(self, keys, rng, dirty_rate=0.02, offset=0):
+        self.rng = rng
+        self.dirty_rate = dirty_rate
+        ids = np.arange(offset, offset + keys)
+        self.wafer = np.array([f"STC{i // 8:05d}{'ABCDEFGH'[i % 8]}" for i in ids], dtype=object)
+        self.spec = np.array([f"SC{i // 2:05d}{'UA' if i % 2 else 'S6'}" for i in ids], dtype=object)
+        self.name = np.array([f"SC{i // 2:05d}-{'GA' if i % 2 else 'CD'}-00NR-{i:06d}" for i in ids], dtype=object)
+        # 各主键的热度排名（各表共用，热门主键在各表中都常见）
+        self.order = rng.permutation(keys)
+
+    def __len__(self):
+        return len(self.name)
+
+    def sample(self, n):
+        """
+        随机取 n 行主键，返回 (晶圆品名, 规格, 品名) 三列。
+        热门主键占多数行（Zipf 分布），与实际订单分布接近。
+        """
+        picks = self.order[(self.rng.zipf(1.3, n) - 1) % len(self)]
+        return tuple(self._dirty(values[picks]) for values in (self.wafer, self.spec, self.name))
+
+    def _dirty(self, values):
+        values = values.copy()
+        hits = np.flatnonzero(self.rng.random(len(values)) < self.dirty_rate)
+        variants = ["{} ", " {}", "{}　", "“{}”", "'{}'"]
+        for position, variant in zip(hits, self.rng.integers(0, len(variants), len(hits))):
+            values[position] = variants[variant].format(values[position])
+        return values
+
+
+def generate_inputs(output_dir, rows=10000, keys=None, duplicate_rate=0.05, mapping_rate=0.1,
+                    dirty_rate=0.02, months=12, start="2025-01-01", seed=0):
+    """
+    生成一套完整的输入文件（内部文件名）：五个主表 + forecast / safety / mapping。
+
+    参数:
+    - output_dir: 输出目录
+    - rows: 五个主表的总行数（平均分配；单个工作表最多 MAX_SHEET_ROWS 行，即总行数最多约 524 万）
+    - keys: 主键（晶圆品名, 规格, 品名）基数，默认 rows // 20
+    - duplicate_rate: 新旧料号表中旧料号重复的比例（其中一半对应不同新料号）
+    - mapping_rate: 参与新旧料号替换的主键比例（其中约 5% 为多级替换）
+    - dirty_rate: 需规范化（全角空格、引号、首尾空格）的主键取值比例
+    - months: 日期列覆盖的月份数（从 start 开始）
+    - seed: 随机种子（相同参数生成相同文件）
+
+    返回:
+    - dict，文件名 → 数据行数
+    """
+    per_file = rows // len(MAIN_FILES)
+    if per_file > MAX_SHEET_ROWS:
+        raise ValueError(f"每个主表 {per_file} 行，超过 Excel 单表上限 {MAX_SHEET_ROWS} 行")
+    keys = keys or max(rows // 20, 10)
+    rng = np.random.default_rng(seed)
+    pool = KeyPool(keys, rng, dirty_rate)
+    os.makedirs(output_dir, exist_ok=True)
+    start = pd.Timestamp(start)
+    span = (start + pd.DateOffset(months=months) - start).days
+
+    def dates(n, missing=0.005):
+        values = start + pd.to_timedelta(rng.integers(0, span, n), unit="D")
+        return values.where(rng.random(n) >= missing)
+
+    def write(name, columns, title_row=None, header=None):
+        _write_workbook(os.path.join(output_dir, name), columns, title_row, header)
+        counts[name] = len(next(iter(columns.values())))
+
+    counts = {}
+    n = per_file
+
+    wafer, spec, name = pool.sample(n)
+    ordered = rng.integers(1, 20, n) * 1000
+    write("unfulfilled_orders.xlsx", {
+        "订单号": np.array([f"SO{i:08d}" for i in range(n)], dtype=object),
+        "客户": rng.choice(["客户A", "客户B", "客户C", "客户D"], n),
+        "晶圆品名": wafer, "规格": spec, "品名": name,
+        "预交货日": dates(n),
+        "订单数量": ordered,
+        "未交订单数量": (ordered * rng.random(n)).astype(np.int64),
+        "备注": np.where(rng.random(n) < 0.1, "加急", None)
+    })
+
+    wafer, spec, name = pool.sample(n)
+    write("finished_products.xlsx", {
+        "工作中心": rng.choice(["封装一部", "封装二部", "测试部"], n),
+        "封装形式": rng.choice(["SOT23-6L", "SOT-23", "DFN2X2", "SOP8"], n),
+        "晶圆型号": wafer, "产品规格": spec, "产品品名": name,
+        "预计完工日期": dates(n),
+        "未交": rng.integers(0, 50, n) * 1000
+    })
+
+    # CP 在制的日期列为 Excel 序列日期（数值）
+    wafer, _, name = pool.sample(n)
+    serials = (dates(n) - EXCEL_EPOCH).days.astype(float)
+    write("cp_in_progress.xlsx", {
+        "晶圆型号": wafer, "产品品名": name,
+        "预计完工日期": serials,
+        "未交": rng.integers(0, 50, n) * 100
+    })
+
+    wafer, spec, name = pool.sample(n)
+    write("finished_inventory.xlsx", {
+        "WAFER品名": wafer, "规格": spec, "品名": name,
+        "仓库名称": rng.choice(["HOLD仓", "成品仓", "半成品仓"], n, p=[0.1, 0.6, 0.3]),
+        "数量": rng.integers(0, 500, n) * 100
+    })
+
+    wafer, spec, _ = pool.sample(n)
+    write("wafer_inventory.xlsx", {
+        "WAFER品名": wafer, "规格": spec,
+        "仓库名称": rng.choice(["HOLD仓", "晶圆仓"], n, p=[0.2, 0.8]),
+        "数量": rng.integers(0, 100, n)
+    })
+
+    # 预测：第 1 行为合计（读入后成为列名），第 2 行才是表头
+    m = max(keys // 2, 1)
+    picks = rng.choice(len(pool), m, replace=False)
+    month_names = [f"{(start + pd.DateOffset(months=i)).month}月预测" for i in range(8)]
+    forecast = {
+        "产品型号": pool.spec[picks], "ProductionNO.": pool.name[picks], "晶圆品名": pool.wafer[picks],
+        "封装类型": rng.choice(["SOT23-6L", "SOT-23", "DFN2X2"], m), "封装厂": rng.choice(["南通宁芯", "浙江赛扬"], m),
+        "档位": np.full(m, None, dtype=object)
+    }
+    for month_name in month_names:
+        forecast[month_name] = rng.integers(0, 100, m) * 100000
+    forecast["合计数量"] = sum(forecast[month_name] for month_name in month_names)
+    forecast["合计金额"] = forecast["合计数量"] * 0.5
+    title = [None] * 6 + [float(forecast[col].sum()) for col in month_names + ["合计数量", "合计金额"]]
+    write("forecast.xlsx", forecast, title_row=title)
+
+    picks = rng.choice(len(pool), m, replace=False)
+    write("safety.xlsx", {
+        "WaferID": pool.wafer[picks], "PartNumber": np.array([f"KH{i % 1000:03d}" for i in picks], dtype=object),
+        "OrderInformation": pool.spec[picks], "Mark": np.array([f"KH{i % 1000:03d}" for i in picks], dtype=object),
+        "ProductionNO.": pool.name[picks],
+        " InvWaf": rng.integers(0, 10, m).astype(float) * 100, " InvPart": rng.integers(0, 10, m).astype(float) * 100000,
+        "备注": np.full(m, None, dtype=object)
+    })
+
+    write("mapping.xlsx", _mapping_columns(pool, rng, keys, mapping_rate, duplicate_rate), header=MAPPING_HEADER)
+    return counts
+
+
+def _mapping_columns(pool, rng, keys, mapping_rate, duplicate_rate):
+    """
+    新旧料号表：旧料号取自主键池，新料号多为池外的新主键，约 5% 指向另一条旧料号（多级替换）；
+    按 duplicate_rate 追加重复的旧料号（一半对应相同新料号，一半对应不同新料号）。
+    """
+    m = max(int(keys * mapping_rate), 1)
+    old = rng.choice(len(pool), m, replace=False)
+    fresh = KeyPool(m, rng, dirty_rate=0, offset=keys)
+    new_wafer, new_spec, new_name = fresh.wafer.copy(), fresh.spec.copy(), fresh.name.copy()
+
+    chained = np.flatnonzero(rng.random(m) < 0.05)
+    targets = rng.choice(m, len(chained))
+    new_wafer[chained] = pool.wafer[old[targets]]
+    new_spec[chained] = pool.spec[old[targets]]
+    new_name[chained] = pool.name[old[targets]]
+
+    rows = np.arange(m)
+    duplicates = rng.choice(m, int(m * duplicate_rate))
+    rows = np.concatenate([rows, duplicates])
+    conflicting = np.zeros(len(rows), dtype=bool)
+    conflicting[m:] = rng.random(len(duplicates)) < 0.5
+    other = rng.choice(m, len(rows))
+
+    semi = np.where(rng.random(len(rows)) < 0.4, np.array([f"NM.{name}" for name in new_name[rows]], dtype=object), None)
+    return {
+        "旧规格": pool.spec[old[rows]], "旧品名": pool.name[old[rows]], "晶圆品名": pool.wafer[old[rows]],
+        "新规格": np.where(conflicting, new_spec[other], new_spec[rows]),
+        "新品名": np.where(conflicting, new_name[other], new_name[rows]),
+        "新晶圆品名": np.where(conflicting, new_wafer[other], new_wafer[rows]),
+        "封装厂": rng.choice(["南通宁芯", "浙江赛扬"], len(rows)), "PC": rng.choice(["方芳", "李雷"], len(rows)),
+        "半成品": semi, "备注": np.full(len(rows), None, dtype=object)
+    }
+
+
+def _write_workbook(path, columns, title_row=None, header=None):
+    """
+    以 openpyxl write-only 模式逐行写出（第一个工作表）。
+    title_row 不为空时写在表头之前；header 为空时表头即 columns 的列名。
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    if title_row is not None:
+        ws.append(title_row)
+    ws.append(header or list(columns))
+    values = [_cell_values(col) for col in columns.values()]
+    for row in zip(*values):
+        ws.append(row)
+    wb.save(path)
+
+
+def _cell_values(values):
+    if isinstance(values, pd.DatetimeIndex):
+        return [None if pd.isna(value) else value.to_pydatetime() for value in values]
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return [None if np.isnan(value) else value for value in values.tolist()]
+    return values.tolist()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="生成一套合成的输入文件（五个主表 + 预测 / 安全库存 / 新旧料号），用于性能测试。")
+    parser.add_argument("output_dir", help="输出目录")
+    parser.add_argument("--rows", type=int, default=10000, help="五个主表的总行数（默认 10000）")
+    parser.add_argument("--keys", type=int, help="主键基数（默认 rows / 20）")
+    parser.add_argument("--dup-rate", type=float, default=0.05, help="新旧料号表中旧料号重复的比例（默认 0.05）")
+    parser.add_argument("--mapping-rate", type=float, default=0.1, help="参与新旧料号替换的主键比例（默认 0.1）")
+    parser.add_argument("--dirty-rate", type=float, default=0.02, help="需规范化的主键取值比例（默认 0.02）")
+    parser.add_argument("--months", type=int, default=12, help="日期覆盖的月份数（默认 12）")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    counts = generate_inputs(
+        args.output_dir, args.rows, args.keys, args.dup_rate, args.mapping_rate,
+        args.dirty_rate, args.months, seed=args.seed
+    )
+    for name, count in counts.items():
+        print(f"{name}: {count} 行")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import pandas as pd
+from date_utils import to_datetime_column
+
+
+def test_to_datetime_column_mixed_serials_and_date_text():
+    # 序列日期、像数字的日期文本、ISO 字符串混在同一列
+    values = pd.Series([45658, "45689", "20250115", "2025.03", "2025-04-20", "未填", None], dtype=object)
+    converted = to_datetime_column(values)
+    expected = pd.to_datetime(["2025-01-01", "2025-02-01", "2025-01-15", "2025-03-01", "2025-04-20", None, None])
+    assert converted.tolist() == list(expected)
@@ -1,6 +1,11 @@
+import json
+from datetime import datetime
 import streamlit as st
 import pandas as pd
-from config import CONFIG, FILE_RENAME_MAPPING
+from config import FILE_RENAME_MAPPING
+from date_utils import parse_month, parse_months
+from job_queue import DONE, QUEUED, RUNNING
+from run_config import RunConfig
 
 def setup_sidebar():
     with st.sidebar:
@@ -15,13 +20,42 @@ def setup_sidebar():
 def get_uploaded_files():
     st.header("📤 Excel 数据处理与汇总")
     
+    # 本次运行的选项只放在 RunConfig 中（每个会话各自一份），不写入全局 CONFIG
+    options = {}
+    # 月份格式不对时提示错误，且不能点击生成
+    month_error = False
+
     # 用户手动输入月份（可为空）
     manual_month = st.text_input("📅 输入历史数据截止月份（格式: YYYY-MM，可留空表示不筛选）")
     if manual_month.strip():
-        CONFIG["selected_month"] = manual_month.strip()
-        st.write(CONFIG["selected_month"])
-    else:
-        CONFIG["selected_month"] = None
+        try:
+            options["selected_month"] = parse_month(manual_month)
+            st.write(options["selected_month"])
+        except ValueError as e:
+            st.error(f"❌ 历史数据截止月份有误，{e}")
+            month_error = True
+
+    # 多个截止月份对比（可为空）
+    sweep_input = st.text_input("📊 多个截止月份对比（格式: YYYY-MM，用逗号分隔，可留空）")
+    try:
+        options["sweep_months"] = parse_months(sweep_input)
+    except ValueError as e:
+        st.error(f"❌ 多个截止月份对比有误，{e}")
+        month_error = True
+    if options.get("sweep_months"):
+        options["sweep_layout"] = st.radio(
+            "对比结果写出方式",
+            ["sheets", "long"],
+            format_func=lambda layout: "每个截止月份一个汇总 sheet" if layout == "sheets" else "一个“截止月份对比”长表",
+            horizontal=True
+        )
+
+    options["reconciliation_sheet"] = st.checkbox("🧾 输出“对账” sheet（各来源主键匹配统计）", value=False)
+    options["drop_zero_rows"] = st.checkbox("🧹 透视前删除数值列全为 0 的行", value=False)
+    options["low_memory"] = st.checkbox("🗜️ 低内存模式（料号等文本列按字典编码处理，适合大文件）", value=False)
+    options["profile_memory"] = st.checkbox("📏 记录各阶段峰值内存（处理会明显变慢，用于排查内存问题）", value=False)
+    options["profile_run"] = st.checkbox("🔬 性能分析本次运行（记录各函数耗时，处理会变慢，用于排查慢的原因）", value=False)
+    run_config = RunConfig.from_config(**options)
         
     uploaded_files = st.file_uploader(
         "📂 上传 5 个核心 Excel 英文文件（未交订单/成品在制/成品库存/晶圆库存/CP在制）",
@@ -47,5 +81,100 @@ def get_uploaded_files():
     mapping_file = st.file_uploader("🔁 上传新旧料号对照表", type="xlsx", key="mapping")
   
 
-    start = st.button("🚀 生成汇总 Excel")
-    return uploaded_dict, forecast_file, safety_file, mapping_file, start
+    start = st.button("🚀 生成汇总 Excel", disabled=month_error)
+    return uploaded_dict, forecast_file, safety_file, mapping_file, start, run_config
+
+
+def show_job(job_queue, job_id):
+    """
+    显示后台任务的阶段进度和提示；任务未结束时每秒刷新一次，完成后提供下载。
+    """
+    status = job_queue.status(job_id)
+    if status is None:
+        st.warning("⚠️ 未找到该任务（可能已过期），请重新生成")
+        return
+    if status["state"] in (QUEUED, RUNNING):
+        _poll_job(job_queue, job_id)
+        return
+
+    _show_job_status(status)
+    if status.get("metrics"):
+        show_metrics(status["metrics"], f"{job_id}.metrics.json")
+    if status.get("profile"):
+        show_profile(status["profile"], job_queue.profile(job_id), f"{job_id}.prof")
+    if status["state"] != DONE:
+        st.error(f"❌ 汇总失败：{status['error']}")
+        return
+
+    file_name = f"运营数据订单-在制-库存汇总报告_{datetime.fromtimestamp(status['submitted']).strftime('%Y%m%d_%H%M%S')}.xlsx"
+    st.success("✅ 汇总完成！你可以下载结果文件：")
+    st.download_button(
+        label="📥 下载 Excel 汇总报告",
+        data=job_queue.result(job_id),
+        file_name=file_name,
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+
+def show_metrics(metrics, file_name="metrics.json"):
+    """
+    折叠面板中显示各阶段的耗时、行数和峰值内存（见 instrumentation.StageMetrics.to_dict），并提供 JSON 下载。
+    """
+    with st.expander(f"⏱️ 各阶段耗时（合计 {metrics['total_seconds']:.2f} 秒）", expanded=False):
+        stages = pd.DataFrame(metrics["stages"], columns=["stage", "source", "seconds", "cpu_seconds", "rows_in", "rows_out", "peak_mb"])
+        stages = stages.astype({"rows_in": "Int64", "rows_out": "Int64"}).rename(columns={
+            "stage": "阶段", "source": "来源", "seconds": "耗时(秒)", "cpu_seconds": "CPU(秒)",
+            "rows_in": "输入行数", "rows_out": "输出行数", "peak_mb": "峰值内存(MB)"
+        })
+        if not metrics["trace_memory"]:
+            stages = stages.drop(columns="峰值内存(MB)")
+        st.dataframe(stages, hide_index=True)
+
+        if metrics["top_allocations"]:
+            st.markdown("**💾 结束时内存占用最多的代码行**")
+            st.code("\n".join(metrics["top_allocations"]))
+
+        st.download_button(
+            label="📥 下载耗时记录（JSON）",
+            data=json.dumps(metrics, ensure_ascii=False, indent=2),
+            file_name=file_name,
+            mime="application/json"
+        )
+
+
+def show_profile(top_functions, data, file_name="profile.prof"):
+    """
+    折叠面板中显示累计耗时最多的函数（见 instrumentation.RunProfile.top_functions），并提供 .prof 文件下载。
+    """
+    with st.expander(f"🔬 性能分析（累计耗时前 {len(top_functions)} 个函数）", expanded=False):
+        functions = pd.DataFrame(top_functions).rename(columns={
+            "function": "函数", "calls": "调用次数", "primitive_calls": "非递归调用次数",
+            "tottime": "自身耗时(秒)", "cumtime": "累计耗时(秒)"
+        })
+        st.dataframe(functions, hide_index=True)
+        if data:
+            st.download_button(
+                label="📥 下载性能分析文件（.prof，可用 snakeviz / pstats 查看）",
+                data=data,
+                file_name=file_name,
+                mime="application/octet-stream"
+            )
+
+
+@st.fragment(run_every=1)
+def _poll_job(job_queue, job_id):
+    status = job_queue.status(job_id)
+    if status is None or status["state"] not in (QUEUED, RUNNING):
+        # 任务结束后整页刷新，显示结果和下载按钮
+        st.rerun()
+    _show_job_status(status)
+
+
+def _show_job_status(status):
+    if status["state"] == QUEUED:
+        text = "⏳ 排队中..."
+    else:
+        text = f"⚙️ {status['stage'] or '开始处理'}"
+    st.progress(status["progress"], text=text)
+    for level, message in status["messages"]:
+        getattr(st, level)(message)